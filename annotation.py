@@ -0,0 +1,197 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def blend(dst, src, alpha):
+    # dst = src * alpha + dst * (1 - alpha), with alpha as a uint8 coverage map
+    a = alpha[..., None].astype(np.uint16)
+    mixed = src.astype(np.uint16) * a + dst.astype(np.uint16) * (255 - a)
+    dst[:] = ((mixed + 127) // 255).astype(np.uint8)
+
+
+def blend_rect(frame, x1, y1, x2, y2, color, alpha):
+    # Translucent fill of one rectangle (inclusive corners), touching only
+    # that region instead of copying and blending the whole frame
+    height, width = frame.shape[:2]
+    x1, y1 = max(x1, 0), max(y1, 0)
+    x2, y2 = min(x2, width - 1), min(y2, height - 1)
+    if x1 > x2 or y1 > y2:
+        return
+    roi = frame[y1:y2 + 1, x1:x2 + 1]
+    fill = np.empty_like(roi)
+    fill[:] = color
+    cv2.addWeighted(fill, alpha, roi, 1 - alpha, 0, roi)
+
+
+class AnnotationRenderer:
+    # Draws detections with as few OpenCV calls as possible: all boxes of
+    # one color go through a single polylines call, and text labels are
+    # rendered once into small patches that are cached by their content
+    def __init__(self, cache_size=4096):
+        self.cache_size = cache_size
+        self._labels = OrderedDict()
+        self._colors = {}
+        self._badges = {}
+
+    def boxes(self, frame, xyxy, color, thickness=1):
+        # Same pixels as one cv2.rectangle per box
+        if not len(xyxy):
+            return
+        x1, y1, x2, y2 = (np.asarray(xyxy, np.int32)[:, i] for i in range(4))
+        polygons = np.stack([np.stack([x1, y1], 1), np.stack([x2, y1], 1),
+                             np.stack([x2, y2], 1), np.stack([x1, y2], 1)], 1)
+        cv2.polylines(frame, list(polygons), True, color, thickness)
+
+    def corners(self, frame, xyxy, length=30, thickness=5, color=(0, 255, 0),
+                rect_thickness=1, rect_color=(255, 0, 255)):
+        # Batched equivalent of cvzone.cornerRect for every box
+        if not len(xyxy):
+            return
+        xyxy = np.asarray(xyxy, np.int32)
+        x, y, x1, y1 = (xyxy[:, i] for i in range(4))
+        if rect_thickness != 0:
+            # cornerRect draws its (x, y, w, h) rectangle one pixel short
+            self.boxes(frame, np.stack([x, y, x1 - 1, y1 - 1], 1), rect_color, rect_thickness)
+
+        segments = []
+        for cx, cy, dx, dy in ((x, y, 1, 1), (x1, y, -1, 1), (x, y1, 1, -1), (x1, y1, -1, -1)):
+            corner = np.stack([cx, cy], 1)
+            segments.append(np.stack([corner, np.stack([cx + dx * length, cy], 1)], 1))
+            segments.append(np.stack([corner, np.stack([cx, cy + dy * length], 1)], 1))
+        segments = list(np.concatenate(segments))
+        cv2.polylines(frame, segments, False, color, thickness)
+
+    def class_colors(self, names, colors, default):
+        # Per-class color table indexed by class id, built once per model
+        key = (id(names), id(colors))
+        table = self._colors.get(key)
+        if table is None:
+            size = max(names) + 1 if names else 0
+            table = [default] * size
+            for class_id, class_name in names.items():
+                table[class_id] = colors.get(class_name.lower(), default)
+            self._colors[key] = table
+        return table
+
+    def label(self, frame, text, pos, scale=3, thickness=3, colorT=(255, 255, 255),
+              colorR=(255, 0, 255), font=cv2.FONT_HERSHEY_PLAIN, offset=10,
+              border=None, colorB=(0, 255, 0)):
+        # Cached equivalent of cvzone.putTextRect
+        key = ('rect', text, scale, thickness, colorT, colorR, font, offset, border, colorB)
+        patch = self._labels.get(key)
+        if patch is None:
+            patch = self._render(text, font, scale, thickness, colorT,
+                                 (colorR, offset, border, colorB))
+            self._store(key, patch)
+        else:
+            self._labels.move_to_end(key)
+        self._blit(frame, patch, pos)
+
+    def text(self, frame, text, pos, font, scale, color, thickness=1):
+        # Cached equivalent of cv2.putText
+        key = ('text', text, font, scale, color, thickness)
+        patch = self._labels.get(key)
+        if patch is None:
+            patch = self._render(text, font, scale, thickness, color, None)
+            self._store(key, patch)
+        else:
+            self._labels.move_to_end(key)
+        self._blit(frame, patch, pos)
+
+    def badge(self, frame, text, color, alpha=0.3, font=cv2.FONT_HERSHEY_SIMPLEX,
+              scale=0.7, thickness=2, padding=10, margin=10):
+        # Translucent box with an opaque border and white text in the lower
+        # right corner. The border and text are pre-rendered once per text,
+        # color and frame size, and only the badge rectangle is blended.
+        height, width = frame.shape[:2]
+        key = (text, color, alpha, font, scale, thickness, padding, margin, width, height)
+        badge = self._badges.get(key)
+        if badge is None:
+            badge = self._render_badge(text, color, font, scale, thickness,
+                                       padding, margin, width, height)
+            if len(self._badges) > 64:
+                self._badges.clear()
+            self._badges[key] = badge
+
+        (x1, y1, x2, y2), patch = badge
+        blend_rect(frame, x1, y1, x2, y2, color, alpha)
+        self._blit(frame, patch, (x1, y1))
+
+    def _render_badge(self, text, color, font, scale, thickness, padding, margin,
+                      width, height):
+        (w, h), _ = cv2.getTextSize(text, font, scale, thickness)
+        x1 = width - (w + 2 * padding) - margin
+        y1 = height - (h + 2 * padding) - margin
+        x2, y2 = width - margin, height - margin
+
+        # Patch covering the box plus the half of the border drawn outside it
+        grow = thickness
+        image = np.zeros((y2 - y1 + 1 + 2 * grow, x2 - x1 + 1 + 2 * grow, 3), np.uint8)
+        border = np.zeros(image.shape[:2], np.uint8)
+        text_mask = np.zeros(image.shape[:2], np.uint8)
+        p1, p2 = (grow, grow), (x2 - x1 + grow, y2 - y1 + grow)
+        cv2.rectangle(border, p1, p2, 255, thickness)
+        origin = (padding + grow, height - margin - padding - y1 + grow)
+        cv2.putText(text_mask, text, origin, font, scale, 255, thickness)
+
+        image[border > 0] = color
+        image[text_mask > 0] = (255, 255, 255)
+        mask = np.maximum(border, text_mask)
+        binary = not np.any((mask > 0) & (mask < 255))
+        return (x1, y1, x2, y2), (image, mask, grow, grow, binary)
+
+    def _store(self, key, patch):
+        self._labels[key] = patch
+        if len(self._labels) > self.cache_size:
+            self._labels.popitem(last=False)
+
+    def _render(self, text, font, scale, thickness, color, background):
+        # Returns (image, mask, dx, dy, binary): a patch relative to the text
+        # origin. The mask is the coverage of the patch; it is only binary
+        # when OpenCV draws text without antialiasing.
+        (w, h), baseline = cv2.getTextSize(text, font, scale, thickness)
+        pad = thickness + baseline + 2
+        left, top, right, bottom = pad, h + pad, w + pad, baseline + pad
+        if background is not None:
+            _, offset, border, _ = background
+            grow = offset + (border or 0)
+            left, top = max(left, grow), max(top, h + grow)
+            right, bottom = max(right, w + grow), max(bottom, grow)
+
+        # Prefilled with the text color so antialiased edges outside the
+        # background keep their color and only the mask carries coverage
+        image = np.empty((top + bottom + 1, left + right + 1, 3), np.uint8)
+        image[:] = color
+        mask = np.zeros(image.shape[:2], np.uint8)
+        org = (left, top)
+        for img, fill in ((image, None), (mask, 255)):
+            if background is not None:
+                colorR, offset, border, colorB = background
+                p1 = (org[0] - offset, org[1] + offset)
+                p2 = (org[0] + w + offset, org[1] - h - offset)
+                cv2.rectangle(img, p1, p2, fill or colorR, cv2.FILLED)
+                if border is not None:
+                    cv2.rectangle(img, p1, p2, fill or colorB, border)
+            cv2.putText(img, text, org, font, scale, fill or color, thickness)
+        binary = not np.any((mask > 0) & (mask < 255))
+        return image, mask, left, top, binary
+
+    def _blit(self, frame, patch, pos):
+        image, mask, dx, dy, binary = patch
+        height, width = frame.shape[:2]
+        x, y = pos[0] - dx, pos[1] - dy
+
+        # Clip the patch against the frame borders
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + image.shape[1], width), min(y + image.shape[0], height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        src = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+        dst = (slice(y0, y1), slice(x0, x1))
+
+        if binary:
+            cv2.copyTo(image[src], mask[src], frame[dst])
+        else:
+            blend(frame[dst], image[src], mask[src])
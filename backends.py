@@ -0,0 +1,113 @@
+import importlib.util
+import os
+import time
+from pathlib import Path
+
+# Inference backends for the YOLO models. 'torch' runs the .pt weights
+# directly; 'onnx' (ONNX Runtime) and 'openvino' run an artifact exported
+# once from them and kept next to the weights. 'onnx-int8' runs the INT8
+# model produced by quantize.py. Ultralytics loads all of them through the
+# same YOLO class, so results and post-processing are identical.
+TORCH = 'torch'
+ONNX = 'onnx'
+OPENVINO = 'openvino'
+INT8 = 'onnx-int8'
+BACKENDS = (TORCH, ONNX, OPENVINO, INT8)
+
+# Python package each exported backend needs at runtime
+RUNTIMES = {ONNX: 'onnxruntime', OPENVINO: 'openvino', INT8: 'onnxruntime'}
+
+# Used instead when a backend's runtime is not installed
+FALLBACKS = {OPENVINO: ONNX, ONNX: TORCH, INT8: ONNX}
+
+
+def is_available(backend):
+    if backend == TORCH:
+        return True
+    return importlib.util.find_spec(RUNTIMES[backend]) is not None
+
+
+def resolve_backend(backend):
+    # Falls back OpenVINO -> ONNX -> torch when a runtime is not installed
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+    candidate = backend
+    while not is_available(candidate):
+        candidate = FALLBACKS[candidate]
+    if candidate != backend:
+        print(f"{backend} backend not available, using {candidate}")
+    return candidate
+
+
+def artifact_path(weights, backend):
+    # Where ultralytics writes the export of weights for backend
+    weights = Path(weights)
+    if backend == ONNX:
+        return weights.with_suffix('.onnx')
+    if backend == OPENVINO:
+        return weights.with_name(weights.stem + '_openvino_model')
+    if backend == INT8:
+        return weights.with_name(weights.stem + '.int8.onnx')
+    return weights
+
+
+def model_files(path):
+    # A model file, or every file of an exported model directory (OpenVINO)
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+
+
+def is_stale(artifact, weights):
+    # Re-export when the artifact is missing or older than the weights; an
+    # artifact deployed without its weights is used as it is
+    if not artifact.exists():
+        return True
+    return os.path.exists(weights) and artifact.stat().st_mtime < os.stat(weights).st_mtime
+
+
+def export_model(spec, backend, imgsz=640, timeout=600):
+    # Exports once per weights file; other processes exporting the same
+    # model at the same time wait on a lock file instead of racing
+    weights = spec['path']
+    artifact = artifact_path(weights, backend)
+    if not is_stale(artifact, weights):
+        return artifact
+
+    lock = f"{artifact}.lock"
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for {lock}")
+            time.sleep(0.5)
+
+    try:
+        if is_stale(artifact, weights):
+            from ultralytics import YOLO
+            print(f"Exporting {weights} to {backend}...")
+            # Dynamic shapes so that batches and the shared rectangular
+            # letterboxed tensors work like they do with the .pt weights
+            YOLO(weights, task=spec['task']).export(format=backend, imgsz=imgsz, dynamic=True)
+        return artifact
+    finally:
+        os.close(fd)
+        os.remove(lock)
+
+
+def model_path(spec):
+    # Path to load for spec['backend'], exporting it first if needed
+    backend = resolve_backend(spec.get('backend', TORCH))
+    if backend == TORCH:
+        return spec['path']
+    if backend == INT8:
+        # Needs calibration frames, so it is never produced implicitly
+        artifact = artifact_path(spec['path'], INT8)
+        if is_stale(artifact, spec['path']):
+            raise FileNotFoundError(f"{artifact} is missing or older than {spec['path']}; "
+                                    f"run quantize.py to create it")
+        return str(artifact)
+    return str(export_model(spec, backend, spec.get('imgsz', 640)))
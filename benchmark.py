@@ -0,0 +1,292 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import types
+
+import cv2
+import numpy as np
+from model_manager import ModelManager
+from preprocess import Preprocessor
+from prototype1 import MODEL_SPECS, MODES, UnifiedDetectionSystem, model_specs
+
+STAGES = ('decode', 'preprocess', 'inference', 'postprocess', 'annotation', 'color', 'encode')
+
+# Class names used by the stub models, close to the real ones so that the
+# drawing code takes the same paths (vehicle colors, smoking face rule, ...)
+STUB_NAMES = {
+    'crowd': {0: 'person'},
+    'fire': {0: 'fire', 1: 'smoke'},
+    'smoking': {0: 'cigarette', 1: 'face', 2: 'smoking'},
+    'vehicle': {0: 'car', 1: 'big bus', 2: 'truck-xl-', 3: 'mid truck', 4: 'small bus'},
+    'weapon': {0: 'gun'},
+}
+STUB_COUNTS = {'crowd': 30, 'fire': 4, 'smoking': 6, 'vehicle': 12, 'weapon': 3}
+
+
+class StubModel:
+    # Stands in for a YOLO model: returns a deterministic set of fake
+    # detections for every input, optionally after a fixed delay
+    def __init__(self, mode, latency=0.0, seed=0):
+        self.names = STUB_NAMES[mode]
+        self.count = STUB_COUNTS[mode]
+        self.latency = latency
+        self.overrides = {'imgsz': 640}
+        self.rng = np.random.default_rng(seed + MODES.index(mode))
+
+    def __call__(self, source, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        if isinstance(source, np.ndarray) and source.ndim == 4:
+            shapes = [source.shape[2:]] * len(source)
+        elif isinstance(source, (list, tuple)):
+            shapes = [frame.shape[:2] for frame in source]
+        elif hasattr(source, 'shape') and len(source.shape) == 4:
+            shapes = [tuple(source.shape[2:])] * source.shape[0]
+        else:
+            shapes = [source.shape[:2]]
+        return [self.result(height, width) for height, width in shapes]
+
+    def result(self, height, width):
+        n = self.count
+        xy = self.rng.uniform(0, 0.8, (n, 2)) * (width, height)
+        wh = self.rng.uniform(0.05, 0.2, (n, 2)) * (width, height)
+        data = np.empty((n, 6), np.float32)
+        data[:, :2] = xy
+        data[:, 2:4] = np.minimum(xy + wh, (width - 1, height - 1))
+        data[:, 4] = self.rng.uniform(0.3, 0.95, n)
+        data[:, 5] = self.rng.integers(0, len(self.names), n)
+        return types.SimpleNamespace(boxes=types.SimpleNamespace(data=data))
+
+
+def make_synthetic_video(path, frames=120, size=(1280, 720), fps=25, seed=0):
+    # Textured background with moving rectangles and circles, so that the
+    # decoder and encoder see realistic rather than flat content
+    width, height = size
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), np.uint8), (0, 0), 3)
+    objects = [(rng.integers(0, width), rng.integers(0, height), rng.integers(-8, 8),
+                rng.integers(-8, 8), tuple(int(c) for c in rng.integers(0, 255, 3)))
+               for _ in range(12)]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    for i in range(frames):
+        frame = background.copy()
+        for k, (x, y, dx, dy, color) in enumerate(objects):
+            cx, cy = int(x + dx * i) % width, int(y + dy * i) % height
+            if k % 2:
+                cv2.circle(frame, (cx, cy), 40, color, -1)
+            else:
+                cv2.rectangle(frame, (cx, cy), (cx + 90, cy + 60), color, -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def real_weights_available():
+    return (importlib.util.find_spec('ultralytics') is not None
+            and all(os.path.exists(spec['path']) for spec in MODEL_SPECS.values()))
+
+
+def make_detector(weights='auto', latency=0.0, backends=None):
+    detector = UnifiedDetectionSystem(backends=backends)
+    detector.predict_args = {'device': 'cpu', 'verbose': False}
+    use_real = weights == 'real' or (weights == 'auto' and real_weights_available())
+    if not use_real:
+        detector.models = ModelManager(model_specs(backends),
+                                       loader=lambda spec: StubModel(spec_mode(spec), latency))
+    if importlib.util.find_spec('torch') is None:
+        # Same preprocessing work, handed to the models as a NumPy batch
+        detector.preprocessor = Preprocessor(as_tensor=False)
+    return detector, use_real
+
+
+def spec_mode(spec):
+    return next(mode for mode, s in MODEL_SPECS.items() if s['path'] == spec['path'])
+
+
+def summarize(samples):
+    ms = np.asarray(samples) * 1000
+    return {'mean_ms': float(ms.mean()), 'p50_ms': float(np.percentile(ms, 50)),
+            'p95_ms': float(np.percentile(ms, 95)), 'count': len(ms)}
+
+
+def benchmark_mode(detector, mode, video_path, max_frames=None):
+    # Runs the stages of the live path one after another on every frame
+    # and times each separately
+    model = detector.models.get(mode)
+    timings = {stage: [] for stage in STAGES}
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    encode_path = os.path.join(tempfile.mkdtemp(), 'encode.avi')
+    writer = None
+    has_pil = importlib.util.find_spec('PIL') is not None
+    if has_pil:
+        from display import to_image
+
+    index = 0
+    clock = time.perf_counter
+    while max_frames is None or index < max_frames:
+        t = clock()
+        ret, frame = cap.read()
+        if not ret:
+            break
+        timings['decode'].append(clock() - t)
+
+        t = clock()
+        prepared = detector.prepare(model, [frame])
+        timings['preprocess'].append(clock() - t)
+
+        t = clock()
+        if prepared is None:
+            results, letterboxes = model([frame], **detector.predict_args), [None]
+        else:
+            letterboxes, tensor = prepared
+            results = model(tensor, **detector.predict_args)
+        timings['inference'].append(clock() - t)
+
+        t = clock()
+        detections = detector.postprocess(mode, model, results[0], letterboxes[0])
+        detector.preprocessor.release()
+        timings['postprocess'].append(clock() - t)
+
+        t = clock()
+        annotated = detector.annotate(frame.copy(), {mode: detections})
+        detector.add_model_indicator(annotated, mode)
+        timings['annotation'].append(clock() - t)
+
+        # What the GUI does before handing the frame to Tk (at full
+        # resolution here, the GUI first scales it to the video widget)
+        t = clock()
+        if has_pil:
+            to_image(annotated)
+        else:
+            cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB)
+        timings['color'].append(clock() - t)
+
+        t = clock()
+        if writer is None:
+            height, width = annotated.shape[:2]
+            writer = cv2.VideoWriter(encode_path, cv2.VideoWriter_fourcc(*'mp4v'), fps,
+                                     (width, height))
+        writer.write(annotated)
+        timings['encode'].append(clock() - t)
+        index += 1
+
+    cap.release()
+    if writer is not None:
+        writer.release()
+        os.remove(encode_path)
+
+    stages = {stage: summarize(samples) for stage, samples in timings.items() if samples}
+    total = sum(stage['mean_ms'] for stage in stages.values())
+    return {'stages': stages, 'frame_ms': total, 'fps': 1000 / total if total else 0.0}
+
+
+def run(video_path=None, modes=MODES, weights='auto', frames=120, size=(1280, 720),
+        latency=0.0, backends=None):
+    detector, use_real = make_detector(weights, latency, backends)
+    if video_path is None:
+        video_path = make_synthetic_video(os.path.join(tempfile.mkdtemp(), 'synthetic.avi'),
+                                          frames, size)
+    # Warm-up frame per mode so model loading is not timed
+    results = {}
+    for mode in modes:
+        benchmark_mode(detector, mode, video_path, 2)
+        results[mode] = benchmark_mode(detector, mode, video_path, frames)
+    return {
+        'meta': {
+            'video': video_path,
+            'frames': frames,
+            'weights': 'real' if use_real else 'stub',
+            'backends': backends,
+            'python': sys.version.split()[0],
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=0.2, min_ms=0.05):
+    # Stages whose median time grew by more than threshold (relative) and
+    # min_ms (absolute, to ignore noise on sub-millisecond stages). The
+    # median is used since single slow frames (first writes, GC) skew means.
+    regressions = []
+    for mode, result in current['results'].items():
+        base = baseline['results'].get(mode)
+        if base is None:
+            continue
+        for stage, stats in result['stages'].items():
+            before = base['stages'].get(stage)
+            if before is None:
+                continue
+            delta = stats['p50_ms'] - before['p50_ms']
+            if delta > min_ms and delta > threshold * before['p50_ms']:
+                regressions.append((mode, stage, before['p50_ms'], stats['p50_ms']))
+    return regressions
+
+
+def print_results(report):
+    meta = report['meta']
+    print(f"weights: {meta['weights']}, frames: {meta['frames']}, video: {meta['video']}")
+    print(f"{'mode':>8} " + ' '.join(f"{stage:>11}" for stage in STAGES) + f" {'fps':>7}")
+    for mode, result in report['results'].items():
+        cells = ' '.join(f"{result['stages'][s]['mean_ms']:>9.2f}ms" if s in result['stages']
+                         else f"{'-':>11}" for s in STAGES)
+        print(f"{mode:>8} {cells} {result['fps']:>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Benchmark every stage for each mode")
+    run_parser.add_argument('--video', help="Video to use instead of a synthetic one")
+    run_parser.add_argument('-m', '--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    run_parser.add_argument('--weights', choices=('auto', 'stub', 'real'), default='auto',
+                            help="Real weights when present (auto), or the stub models")
+    run_parser.add_argument('--frames', type=int, default=120)
+    run_parser.add_argument('--size', type=int, nargs=2, default=[1280, 720],
+                            metavar=('WIDTH', 'HEIGHT'))
+    run_parser.add_argument('--stub-latency', type=float, default=0.0,
+                            help="Seconds each stub model call sleeps")
+    run_parser.add_argument('--backend', help="Backend for every model (torch, onnx, ...)")
+    run_parser.add_argument('-o', '--output', help="JSON file for the results")
+
+    compare_parser = subparsers.add_parser('compare', help="Flag regressions against a baseline")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help="Allowed relative slowdown per stage")
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        report = run(args.video, args.modes, args.weights, args.frames, tuple(args.size),
+                     args.stub_latency, args.backend)
+        print_results(report)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Saved {args.output}")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for mode, stage, before, after in regressions:
+            print(f"REGRESSION {mode}/{stage}: {before:.2f}ms -> {after:.2f}ms "
+                  f"(+{(after / before - 1) * 100:.0f}%)")
+        if not regressions:
+            print("No regressions")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
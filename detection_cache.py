@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from backends import model_files
+from detections import Detections
+from metrics import FRAMES_SKIPPED
+from prototype1 import DetectorWrapper
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path, sample_size=1 << 20, samples=16):
+    # Content hash of a (possibly very large) file: its size plus evenly
+    # spaced samples including the head and tail. Memoized per size and
+    # mtime, so a file replaced on disk is hashed again.
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        if key in _digests:
+            return _digests[key]
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(stat.st_size).encode())
+    with open(path, 'rb') as f:
+        if stat.st_size <= sample_size * samples:
+            for chunk in iter(lambda: f.read(sample_size), b''):
+                h.update(chunk)
+        else:
+            step = (stat.st_size - sample_size) // (samples - 1)
+            for i in range(samples):
+                f.seek(i * step)
+                h.update(f.read(sample_size))
+    digest = h.hexdigest()
+
+    with _digests_lock:
+        _digests[key] = digest
+    return digest
+
+
+def model_digest(path):
+    if not os.path.isdir(path):
+        return file_digest(path)
+    h = hashlib.blake2b(digest_size=16)
+    for name in model_files(path):
+        h.update(os.path.relpath(name, path).encode())
+        h.update(file_digest(name).encode())
+    return h.hexdigest()
+
+
+def pack(detections):
+    # (N, 6) float32 rows of [x1, y1, x2, y2, conf, cls]; pixel coordinates
+    # and class ids are exact in float32
+    data = np.empty((len(detections), 6), np.float32)
+    data[:, :4] = detections.xyxy
+    data[:, 4] = detections.conf
+    data[:, 5] = detections.cls
+    return data.tobytes()
+
+
+def unpack(mode, names, blob):
+    data = np.frombuffer(blob, np.float32).reshape(-1, 6)
+    return Detections(mode, names, data[:, :4].astype(np.int32),
+                      data[:, 4].copy(), data[:, 5].astype(np.int32))
+
+
+class DetectionCache:
+    # Raw per-frame detections stored in one SQLite file, keyed by video
+    # content hash, frame index and model key. The model key covers the
+    # mode, the weights file hash, the threshold and the predict arguments.
+    # Rows are evicted least-recently-used once the cache exceeds max_bytes.
+    def __init__(self, path='cache/detections.sqlite', max_bytes=256 * 1024 * 1024,
+                 commit_every=64):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS models '
+                         '(key TEXT PRIMARY KEY, mode TEXT, weights TEXT, names TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS detections '
+                         '(video TEXT, model TEXT, frame INTEGER, data BLOB, used REAL, '
+                         'PRIMARY KEY (video, model, frame))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS detections_used ON detections (used)')
+        self._size = self._db.execute(
+            'SELECT COALESCE(SUM(LENGTH(data)), 0) FROM detections').fetchone()[0]
+        self._pending = 0
+        self._names = {}
+        self._modes = {}
+
+    def model_key(self, mode, model_path, threshold, predict_args):
+        # model_path is what the model is actually loaded from: an exported
+        # or quantized artifact changes without its .pt weights changing
+        weights = model_digest(model_path)
+        settings = {k: v for k, v in predict_args.items() if k != 'verbose'}
+        raw = json.dumps([mode, weights, threshold, sorted(settings.items())], default=str)
+        key = hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+        with self._lock:
+            stale = self._db.execute('SELECT key FROM models WHERE mode = ? AND weights != ?',
+                                     (mode, weights)).fetchall()
+            if stale:
+                # The model changed: results of the old one are dropped
+                for (old,) in stale:
+                    self._db.execute('DELETE FROM detections WHERE model = ?', (old,))
+                    self._db.execute('DELETE FROM models WHERE key = ?', (old,))
+                self._size = self._db.execute(
+                    'SELECT COALESCE(SUM(LENGTH(data)), 0) FROM detections').fetchone()[0]
+                self._db.commit()
+            self._db.execute('INSERT OR IGNORE INTO models (key, mode, weights) VALUES (?, ?, ?)',
+                             (key, mode, weights))
+            self._modes[key] = mode
+        return key
+
+    def names(self, model):
+        # Class names of a model, so cache hits never need the model loaded
+        if model not in self._names:
+            with self._lock:
+                row = self._db.execute('SELECT names FROM models WHERE key = ?',
+                                       (model,)).fetchone()
+            if not row or row[0] is None:
+                return None
+            self._names[model] = {int(k): v for k, v in json.loads(row[0]).items()}
+        return self._names[model]
+
+    def get(self, video, model, frame_index):
+        names = self.names(model)
+        with self._lock:
+            row = None if names is None else self._db.execute(
+                'SELECT data FROM detections WHERE video = ? AND model = ? AND frame = ?',
+                (video, model, frame_index)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute('UPDATE detections SET used = ? WHERE video = ? AND model = ? '
+                             'AND frame = ?', (time.time(), video, model, frame_index))
+            self._tick()
+        return unpack(self._modes.get(model), names, row[0])
+
+    def put(self, video, model, frame_index, detections):
+        blob = pack(detections)
+        with self._lock:
+            if model not in self._names:
+                self._names[model] = detections.names
+                self._db.execute('UPDATE models SET names = ? WHERE key = ?',
+                                 (json.dumps(detections.names), model))
+            old = self._db.execute(
+                'SELECT LENGTH(data) FROM detections WHERE video = ? AND model = ? AND frame = ?',
+                (video, model, frame_index)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?)',
+                             (video, model, frame_index, blob, time.time()))
+            self._size += len(blob) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._tick()
+
+    def flush(self):
+        with self._lock:
+            self._db.commit()
+            self._pending = 0
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM detections')
+            self._db.commit()
+            self._size = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    def _tick(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self._db.commit()
+            self._pending = 0
+
+    def _evict(self):
+        # Drop the least recently used rows until 90% of the budget is left
+        target = self.max_bytes * 0.9
+        rows = self._db.execute('SELECT video, model, frame, LENGTH(data) FROM detections '
+                                'ORDER BY used')
+        doomed = []
+        size = self._size
+        for video, model, frame, length in rows:
+            if size <= target:
+                break
+            doomed.append((video, model, frame))
+            size -= length
+        self._db.executemany('DELETE FROM detections WHERE video = ? AND model = ? AND frame = ?',
+                             doomed)
+        self._size = size
+
+
+class CachedDetector(DetectorWrapper):
+    # Serves detections from a DetectionCache when the same frame of the
+    # same video was already inferred with the same model and settings, so
+    # seeking back, restarting or re-exporting only costs decode and drawing.
+    # Frames without an index (or with no video set) pass straight through.
+    def __init__(self, detector, cache=None, video_path=None):
+        super().__init__(detector)
+        self.cache = cache if cache is not None else DetectionCache()
+        self.video = None
+        self._keys = {}
+        if video_path:
+            self.set_video(video_path)
+
+    def set_video(self, video_path):
+        self.video = file_digest(video_path) if video_path else None
+
+    def key(self, mode):
+        # Recomputed whenever the threshold, the predict arguments or the
+        # loaded model file (e.g. re-quantized) change; the model hash
+        # itself is memoized by file size and mtime
+        spec = self.models.specs[mode]
+        path = self.models.path(mode)
+        predict_args = dict(self.predict_args, tiles=self.tile_settings(mode),
+                            backend=spec.get('backend'))
+        settings = (self.thresholds[mode], repr(sorted(predict_args.items())), path,
+                    tuple(os.stat(name).st_mtime_ns for name in model_files(path)))
+        cached = self._keys.get(mode)
+        if cached is None or cached[0] != settings:
+            key = self.cache.model_key(mode, path, self.thresholds[mode], predict_args)
+            cached = self._keys[mode] = (settings, key)
+        return cached[1]
+
+    def predict(self, frame, modes, frame_index=None):
+        return self.predict_batch([frame], modes, [frame_index])[0]
+
+    def predict_batch(self, frames, modes, frame_indices=None):
+        modes = self.resolve_modes(modes)
+        if not modes:
+            return [{} for _ in frames]
+        if self.video is None or frame_indices is None or None in frame_indices:
+            return self.detector.predict_batch(frames, modes, frame_indices)
+
+        keys = {mode: self.key(mode) for mode in modes}
+        outputs = [{} for _ in frames]
+        missing = {}
+        for i, index in enumerate(frame_indices):
+            for mode in modes:
+                detections = self.cache.get(self.video, keys[mode], index)
+                if detections is None:
+                    missing.setdefault(mode, []).append(i)
+                else:
+                    outputs[i][mode] = detections
+        # Frames served from the cache for every mode skip inference entirely
+        FRAMES_SKIPPED.inc(len(frames) - len({i for rows in missing.values() for i in rows}),
+                           reason='cache', source=self.metrics_source)
+
+        # Infer only the missing (frame, mode) pairs, batching the frames
+        # that miss the same set of modes
+        groups = {}
+        for mode in modes:
+            for i in missing.get(mode, ()):
+                groups.setdefault(i, []).append(mode)
+        by_modes = {}
+        for i, group in groups.items():
+            by_modes.setdefault(tuple(group), []).append(i)
+
+        for group, rows in by_modes.items():
+            if len(rows) == 1:
+                results = [self.detector.predict(frames[rows[0]], group, frame_indices[rows[0]])]
+            else:
+                results = self.detector.predict_batch([frames[i] for i in rows], group,
+                                                      [frame_indices[i] for i in rows])
+            for i, detections in zip(rows, results):
+                for mode in group:
+                    outputs[i][mode] = detections[mode]
+                    self.cache.put(self.video, keys[mode], frame_indices[i], detections[mode])
+        return outputs
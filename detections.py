@@ -0,0 +1,131 @@
+import numpy as np
+
+
+def box_intersection(boxes_a, boxes_b):
+    # Pairwise intersection areas and the areas of each side's boxes for
+    # (N, 4) and (M, 4) xyxy boxes -> (N, M), (N,), (M,)
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter, area_a, area_b
+
+
+def box_iou(boxes_a, boxes_b):
+    # Pairwise IoU between (N, 4) and (M, 4) xyxy boxes -> (N, M)
+    inter, area_a, area_b = box_intersection(boxes_a, boxes_b)
+    union = area_a[:, None] + area_b[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def box_ios(boxes_a, boxes_b):
+    # Pairwise intersection over the smaller box's area -> (N, M); close to
+    # 1 when a box cut at a tile border lies inside the full box
+    inter, area_a, area_b = box_intersection(boxes_a, boxes_b)
+    return inter / np.maximum(np.minimum(area_a[:, None], area_b[None, :]), 1e-9)
+
+
+def nms(xyxy, conf, cls, threshold=0.5, overlap=box_iou, groups=None):
+    # Greedy per-class non-maximum suppression; returns the kept indices
+    # in descending confidence order. With groups (one id per box), boxes
+    # of the same group never suppress each other.
+    order = np.argsort(-np.asarray(conf), kind='stable')
+    xyxy, cls = np.asarray(xyxy)[order], np.asarray(cls)[order]
+    # One overlap matrix for all boxes; pairs of different classes never suppress
+    suppress = (overlap(xyxy, xyxy) > threshold) & (cls[:, None] == cls[None, :])
+    if groups is not None:
+        groups = np.asarray(groups)[order]
+        suppress &= groups[:, None] != groups[None, :]
+    keep = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep[i + 1:] &= ~suppress[i, i + 1:]
+    return order[keep]
+
+
+class Detections:
+    # Detections of one model on one frame, kept as parallel NumPy arrays:
+    # xyxy (N, 4) int32 pixel boxes, conf (N,) float32, cls (N,) int32
+    def __init__(self, mode, names, xyxy=None, conf=None, cls=None):
+        self.mode = mode
+        self.names = names
+        self.xyxy = np.zeros((0, 4), np.int32) if xyxy is None else xyxy
+        self.conf = np.zeros(0, np.float32) if conf is None else conf
+        self.cls = np.zeros(0, np.int32) if cls is None else cls
+
+    @classmethod
+    def from_result(cls, mode, names, result, threshold=0.0, unmap=None):
+        # boxes.data is (N, 6) [x1, y1, x2, y2, conf, cls], so the whole
+        # frame is moved to the host in a single transfer. unmap converts
+        # the boxes back to frame coordinates when the model was given an
+        # already letterboxed tensor.
+        data = result.boxes.data
+        if hasattr(data, 'cpu'):
+            data = data.cpu().numpy()
+        data = np.asarray(data, dtype=np.float32)
+        if data.size == 0:
+            return cls(mode, names)
+        data = data[data[:, -2] > threshold]
+        if unmap is not None:
+            data[:, :4] = unmap(data[:, :4])
+        return cls(mode, names,
+                   data[:, :4].astype(np.int32),
+                   data[:, -2].copy(),
+                   data[:, -1].astype(np.int32))
+
+    @classmethod
+    def concatenate(cls, items, mode=None, names=None):
+        items = list(items)
+        if not items:
+            return cls(mode, names)
+        return cls(items[0].mode if mode is None else mode,
+                   items[0].names if names is None else names,
+                   np.concatenate([d.xyxy for d in items]),
+                   np.concatenate([d.conf for d in items]),
+                   np.concatenate([d.cls for d in items]))
+
+    def __len__(self):
+        return len(self.conf)
+
+    def __getitem__(self, index):
+        # Boolean mask, index array or slice -> filtered Detections
+        return Detections(self.mode, self.names, self.xyxy[index], self.conf[index], self.cls[index])
+
+    def with_boxes(self, xyxy):
+        return Detections(self.mode, self.names, xyxy, self.conf, self.cls)
+
+    def scaled(self, scale):
+        # Boxes of the same frame resized by scale (e.g. for display)
+        return self.with_boxes(np.rint(self.xyxy * scale).astype(np.int32))
+
+    def of_class(self, *class_ids):
+        return self[np.isin(self.cls, class_ids)]
+
+    def above(self, threshold):
+        return self[self.conf > threshold]
+
+    def nms(self, threshold=0.5, overlap=box_iou, groups=None):
+        return self[nms(self.xyxy, self.conf, self.cls, threshold, overlap, groups)]
+
+    def class_names(self):
+        return [self.names[c] for c in self.cls.tolist()]
+
+    def to_records(self):
+        # Plain per-detection dicts, for export and the merged detection list
+        return [
+            {
+                'mode': self.mode,
+                'class_id': class_id,
+                'class_name': self.names[class_id],
+                'confidence': confidence,
+                'box': tuple(box),
+            }
+            for box, confidence, class_id in zip(self.xyxy.tolist(),
+                                                 self.conf.tolist(),
+                                                 self.cls.tolist())
+        ]
@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+
+def fit_size(shape, bounds):
+    # Largest (width, height) with the frame's aspect ratio inside bounds
+    height, width = shape[:2]
+    max_w, max_h = bounds
+    scale = min(max_w / width, max_h / height)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def resize_to(frame, size):
+    # Area interpolation when shrinking (no aliasing, and it reads each
+    # source pixel once), linear when enlarging
+    if (frame.shape[1], frame.shape[0]) == size:
+        return frame
+    shrinking = size[0] < frame.shape[1]
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+
+
+def to_image(frame):
+    # PIL image straight from the BGR buffer: the 'BGR' raw decoder swaps
+    # channels while copying into PIL's storage, so no RGB array is made
+    frame = np.ascontiguousarray(frame)
+    height, width = frame.shape[:2]
+    return Image.frombuffer('RGB', (width, height), frame, 'raw', 'BGR', 0, 1)
+
+
+class DisplaySurface:
+    # One PhotoImage reused for every frame of the same size: paste() writes
+    # the pixels into the existing Tk image instead of creating a new one.
+    # Tk objects, so only use it from the main loop.
+    def __init__(self):
+        self.photo = None
+
+    def show(self, image):
+        # Returns True when a new PhotoImage had to be created, i.e. the
+        # widget has to be pointed at self.photo
+        if self.photo is not None and (self.photo.width(), self.photo.height()) == image.size:
+            self.photo.paste(image)
+            return False
+        self.photo = ImageTk.PhotoImage(image=image)
+        return True
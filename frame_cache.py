@@ -0,0 +1,118 @@
+import os
+import threading
+
+import numpy as np
+
+RAW = 0
+ANNOTATED = 1
+
+
+class FrameRing:
+    # The most recently decoded frames of one video, in a fixed number of
+    # slots of a memory-mapped file so that the ring can be larger than what
+    # should stay resident; the OS pages slots in and out as needed. Each
+    # slot can also hold the frame's annotated version and its detections,
+    # tagged with a key describing how they were produced (modes, tiling),
+    # so that the detection stage can reuse them. The oldest slot is
+    # overwritten first.
+    def __init__(self, path='cache/frames.ring', max_bytes=1024 * 1024 * 1024, annotated=True):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.annotated = annotated
+        self.shape = None
+        self.slots = 0
+        self._data = None
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        # Forgets every frame, e.g. when another video is opened
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._slot_of = {}
+        self._owner = [None] * self.slots
+        self._annotated_key = [None] * self.slots
+        self._detections = [None] * self.slots
+        self._next = 0
+
+    def _allocate(self, shape):
+        planes = 2 if self.annotated else 1
+        frame_bytes = int(np.prod(shape))
+        self.slots = max(1, self.max_bytes // (frame_bytes * planes))
+        # Unmap the old file before it is recreated at the new size
+        self._data = None
+        self._data = np.memmap(self.path, np.uint8, 'w+', shape=(planes, self.slots) + shape)
+        self.shape = shape
+        self._reset()
+
+    def __contains__(self, index):
+        with self._lock:
+            return index in self._slot_of
+
+    def __len__(self):
+        with self._lock:
+            return len(self._slot_of)
+
+    def put(self, index, frame):
+        with self._lock:
+            if frame.shape != self.shape:
+                self._allocate(frame.shape)
+            if index in self._slot_of:
+                # Decoded again after a seek: same pixels, keep what is stored
+                return
+            slot = self._next
+            self._next = (slot + 1) % self.slots
+            if self._owner[slot] is not None:
+                del self._slot_of[self._owner[slot]]
+            self._owner[slot] = index
+            self._slot_of[index] = slot
+            self._annotated_key[slot] = None
+            self._detections[slot] = None
+            self._data[RAW, slot] = frame
+
+    def get(self, index):
+        # A copy, since the slot is overwritten once the ring wraps around
+        with self._lock:
+            slot = self._slot_of.get(index)
+            return None if slot is None else np.array(self._data[RAW, slot])
+
+    def put_annotated(self, index, key, frame):
+        with self._lock:
+            slot = self._slot_of.get(index)
+            if slot is None or not self.annotated or frame.shape != self.shape:
+                return
+            self._data[ANNOTATED, slot] = frame
+            self._annotated_key[slot] = key
+
+    def get_annotated(self, index, key):
+        with self._lock:
+            slot = self._slot_of.get(index)
+            if slot is None or self._annotated_key[slot] != key:
+                return None
+            return np.array(self._data[ANNOTATED, slot])
+
+    def put_detections(self, index, key, detections):
+        with self._lock:
+            slot = self._slot_of.get(index)
+            if slot is not None:
+                self._detections[slot] = (key, detections)
+
+    def get_detections(self, index, key):
+        with self._lock:
+            slot = self._slot_of.get(index)
+            entry = None if slot is None else self._detections[slot]
+            return entry[1] if entry is not None and entry[0] == key else None
+
+    def close(self):
+        with self._lock:
+            self._data = None
+            self.shape = None
+            self.slots = 0
+            self._reset()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
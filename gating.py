@@ -0,0 +1,140 @@
+import cv2
+import numpy as np
+from metrics import FRAMES_SKIPPED
+from prototype1 import DetectorWrapper
+
+# Reasons returned by MotionGate.check()
+REFRESH = 'refresh'
+DUPLICATE = 'duplicate'
+STATIC = 'static'
+MOTION = 'motion'
+
+
+class MotionGate:
+    # Decides whether a frame differs enough from the last inferred one to
+    # be worth running the models on. Works on a small blurred grayscale
+    # copy: pixels that changed against the reference frame are grouped
+    # into blobs, and the frame counts as motion once the largest blob
+    # reaches a size derived from the sensitivity (0..1). A small object
+    # entering a large frame is one compact blob, so it is not lost in a
+    # threshold on the total changed area. Comparing against the last
+    # inferred frame rather than the previous one means slow changes still
+    # add up to a refresh.
+    def __init__(self, sensitivity=0.5, refresh_interval=30, width=160):
+        self.sensitivity = sensitivity
+        # Inference is forced once the reference frame is this many video
+        # frames old (0 disables), however often check() is called
+        self.refresh_interval = refresh_interval
+        self.width = width
+        self.checked = 0
+        self.counts = {REFRESH: 0, DUPLICATE: 0, STATIC: 0, MOTION: 0}
+        self.kernel = np.ones((3, 3), np.uint8)
+        self.reset()
+
+    def reset(self):
+        # The next frame is always inferred
+        self.reference = None
+        self.reference_index = None
+        self.changed = 0
+
+    @property
+    def pixel_threshold(self):
+        # Gray level difference that counts as a changed pixel
+        return 5 + 40 * (1 - self.sensitivity)
+
+    @property
+    def blob_threshold(self):
+        # Area in thumbnail pixels of the smallest changed blob that counts
+        # as motion; at the default width and sensitivity an object of
+        # about 30x40 pixels in a 1080p frame
+        return 4 + 40 * (1 - self.sensitivity)
+
+    @property
+    def skip_ratio(self):
+        skipped = self.counts[DUPLICATE] + self.counts[STATIC]
+        return skipped / self.checked if self.checked else 0.0
+
+    def stats(self):
+        return {
+            'checked': self.checked,
+            'skip_ratio': self.skip_ratio,
+            'sensitivity': self.sensitivity,
+            'refresh_interval': self.refresh_interval,
+            'last_change': self.changed,
+            **self.counts,
+        }
+
+    def thumbnail(self, frame):
+        height, width = frame.shape[:2]
+        size = (self.width, max(1, round(height * self.width / width)))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def largest_blob(self, gray):
+        # Area of the largest group of changed pixels; the dilation joins
+        # the pieces of an object whose inside matches the background
+        changed = (cv2.absdiff(gray, self.reference) > self.pixel_threshold).astype(np.uint8)
+        if not changed.any():
+            return 0
+        changed = cv2.dilate(changed, self.kernel)
+        _, _, blobs, _ = cv2.connectedComponentsWithStats(changed, connectivity=8)
+        return int(blobs[1:, cv2.CC_STAT_AREA].max())
+
+    def check(self, frame, frame_index=None):
+        # Returns (infer, reason) and takes the frame as the new reference
+        # whenever it is inferred. Without a frame_index every call counts
+        # as one frame towards the refresh.
+        gray = self.thumbnail(frame)
+        position = self.checked if frame_index is None else frame_index
+        self.checked += 1
+
+        if (self.reference is None or self.reference.shape != gray.shape
+                or (self.refresh_interval
+                    and position - self.reference_index >= self.refresh_interval)):
+            reason = REFRESH
+        else:
+            self.changed = self.largest_blob(gray)
+            if self.changed >= self.blob_threshold:
+                reason = MOTION
+            else:
+                reason = DUPLICATE if self.changed == 0 else STATIC
+
+        self.counts[reason] += 1
+        infer = reason in (REFRESH, MOTION)
+        if infer:
+            self.reference = gray
+            self.reference_index = position
+        return infer, reason
+
+
+class GatedDetector(DetectorWrapper):
+    # Reuses the previous detections while the MotionGate reports a static
+    # scene, and only calls the wrapped detector when something changed
+    def __init__(self, detector, gate=None, max_gap=15):
+        super().__init__(detector)
+        self.gate = gate or MotionGate()
+        self.max_gap = max_gap
+        self.modes = ()
+        self.last = None
+        self.last_index = None
+        self.reason = None
+
+    def predict(self, frame, modes, frame_index=None):
+        modes = self.resolve_modes(modes)
+        if not modes:
+            return {}
+        # Mode changes and seeks always go to the models; small forward gaps
+        # are frames dropped by a live pipeline
+        if modes != self.modes or (frame_index is not None and self.last_index is not None
+                                   and not 0 < frame_index - self.last_index <= self.max_gap):
+            self.gate.reset()
+        self.last_index = frame_index
+
+        infer, self.reason = self.gate.check(frame, frame_index)
+        if infer or self.last is None:
+            self.last = self.detector.predict(frame, modes, frame_index)
+            self.modes = modes
+        else:
+            FRAMES_SKIPPED.inc(reason=self.reason, source=self.metrics_source)
+        return self.last
@@ -0,0 +1,190 @@
+import argparse
+import bisect
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import threading
+from fractions import Fraction
+
+
+def index_path(video_path):
+    return f"{video_path}.keyframes.json"
+
+
+def file_signature(video_path):
+    stat = os.stat(video_path)
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+class KeyframeIndex:
+    # Frame numbers (as counted by CAP_PROP_POS_FRAMES) and timestamps of
+    # the keyframes of a video's first video stream
+    def __init__(self, video_path, fps, frame_count, keyframes, times):
+        self.video_path = video_path
+        self.fps = fps
+        self.frame_count = frame_count
+        self.keyframes = keyframes
+        self.times = times
+
+    def preceding(self, frame_index):
+        # Last keyframe at or before frame_index (the first one if none is)
+        i = bisect.bisect_right(self.keyframes, frame_index) - 1
+        return self.keyframes[max(i, 0)] if self.keyframes else 0
+
+    def save(self):
+        data = {
+            'signature': file_signature(self.video_path),
+            'fps': self.fps,
+            'frame_count': self.frame_count,
+            'keyframes': self.keyframes,
+            'times': self.times,
+        }
+        partial = index_path(self.video_path) + '.partial'
+        try:
+            with open(partial, 'w') as f:
+                json.dump(data, f)
+            os.replace(partial, index_path(self.video_path))
+        except OSError as e:
+            # Read-only media: the index is still used for this session
+            print(f"Could not save keyframe index for {self.video_path}: {e}")
+
+    @classmethod
+    def load(cls, video_path):
+        # None when there is no index or the video changed since
+        try:
+            with open(index_path(video_path)) as f:
+                data = json.load(f)
+            if data['signature'] != file_signature(video_path):
+                return None
+            return cls(video_path, data['fps'], data['frame_count'], data['keyframes'],
+                       data['times'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def scan_pyav(video_path, cancel):
+    # Demuxes packets only, nothing is decoded
+    import av
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        base = stream.time_base
+        start = float((stream.start_time or 0) * base)
+        fps = float(stream.average_rate or 0)
+        times, keyframes = [], []
+        for packet in container.demux(stream):
+            if cancel.is_set():
+                return None
+            if packet.pts is None:
+                continue
+            t = float(packet.pts * base) - start
+            times.append(t)
+            if packet.is_keyframe:
+                keyframes.append(t)
+    return fps, len(times), keyframes
+
+
+def scan_ffprobe(video_path, cancel):
+    # Same as scan_pyav through ffprobe's packet listing
+    rate = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                           '-show_entries', 'stream=avg_frame_rate', '-of', 'csv=p=0',
+                           video_path], capture_output=True, text=True, check=True).stdout
+    try:
+        fps = float(Fraction(rate.strip()))
+    except (ValueError, ZeroDivisionError):
+        fps = 0.0
+
+    process = subprocess.Popen(['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                                '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0',
+                                video_path], stdout=subprocess.PIPE, text=True)
+    times, keyframes = [], []
+    try:
+        for line in process.stdout:
+            if cancel.is_set():
+                return None
+            pts_time, _, flags = line.strip().partition(',')
+            if not pts_time or pts_time == 'N/A':
+                continue
+            times.append(float(pts_time))
+            if 'K' in flags:
+                keyframes.append(float(pts_time))
+    finally:
+        process.kill()
+        process.wait()
+    if times:
+        start = min(times)
+        keyframes = [t - start for t in keyframes]
+    return fps, len(times), keyframes
+
+
+def build_index(video_path, cancel=None):
+    # Scans the video once with PyAV, or ffprobe when PyAV is not installed.
+    # Returns None when neither is available or the scan was cancelled.
+    cancel = cancel or threading.Event()
+    if importlib.util.find_spec('av') is not None:
+        scanned = scan_pyav(video_path, cancel)
+    elif shutil.which('ffprobe'):
+        scanned = scan_ffprobe(video_path, cancel)
+    else:
+        return None
+    if scanned is None:
+        return None
+
+    fps, frame_count, keyframe_times = scanned
+    times = sorted(keyframe_times)
+    keyframes = [int(round(t * fps)) for t in times] if fps else []
+    return KeyframeIndex(video_path, fps, frame_count, keyframes, times)
+
+
+def load_or_build(video_path, cancel=None):
+    index = KeyframeIndex.load(video_path)
+    if index is None:
+        index = build_index(video_path, cancel)
+        if index is not None:
+            index.save()
+    return index
+
+
+class KeyframeIndexer:
+    # Loads or builds a video's index in a background thread and hands it
+    # to on_done (None when the video cannot be indexed); cancel() abandons
+    # it, e.g. when another video is opened
+    def __init__(self, video_path, on_done):
+        self.video_path = video_path
+        self.on_done = on_done
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='keyframe-indexer')
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _run(self):
+        try:
+            index = load_or_build(self.video_path, self._cancel)
+        except (OSError, subprocess.SubprocessError, ValueError) as e:
+            print(f"Keyframe indexing failed for {self.video_path}: {e}")
+            index = None
+        if not self._cancel.is_set():
+            self.on_done(index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build keyframe indexes for fast seeking")
+    parser.add_argument('videos', nargs='+')
+    args = parser.parse_args()
+    for video in args.videos:
+        index = load_or_build(video)
+        if index is None:
+            print(f"{video}: PyAV or ffprobe is needed to index videos")
+            continue
+        print(f"{video}: {len(index.keyframes)} keyframes in {index.frame_count} frames "
+              f"-> {index_path(video)}")
+
+
+if __name__ == "__main__":
+    main()
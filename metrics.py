@@ -0,0 +1,256 @@
+import bisect
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds, from a fraction of a frame to several seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    # Counts exactly, floats with every digit: '{:g}' would round a counter
+    # past a million to six significant digits
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels) + '}'
+
+
+class Metric:
+    # Values are kept per label set, a sorted tuple of (name, value) pairs
+    kind = None
+
+    def __init__(self, name, help=''):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def samples(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.samples():
+            lines.append(f"{self.name}{format_labels(labels)} {format_value(value)}")
+        return lines
+
+    def snapshot(self):
+        return {format_labels(labels) or '': value for labels, value in self.samples()}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help='', buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket counts (last one is +Inf), sum, count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            return [(labels, (list(counts), total, count))
+                    for labels, (counts, total, count) in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, (counts, total, count) in self.samples():
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                le = bound if isinstance(bound, str) else f'{bound:g}'
+                lines.append(f"{self.name}_bucket{format_labels(labels + (('le', le),))} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+    def snapshot(self):
+        result = {}
+        for labels, (counts, total, count) in self.samples():
+            result[format_labels(labels) or ''] = {
+                'count': count,
+                'sum': total,
+                'mean': total / count if count else 0.0,
+                'p50': self.quantile(counts, count, 0.5),
+                'p95': self.quantile(counts, count, 0.95),
+            }
+        return result
+
+    def quantile(self, counts, count, q):
+        # Upper bound of the bucket holding the q-quantile (None when it
+        # is beyond the last bucket)
+        if not count:
+            return None
+        rank, cumulative = q * count, 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            if cumulative >= rank:
+                return bound
+        return None
+
+
+class Registry:
+    # Metrics by name; counter()/gauge()/histogram() return the existing
+    # metric when it was already created, so modules can declare the same
+    # metric independently
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name, help=''):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help=''):
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name, help='', buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def render(self):
+        # Prometheus text exposition format
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+    def snapshot(self):
+        # Plain dict for the Python API: {name: {labels: value}}
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = Registry()
+
+# Metrics of the detection path, shared by every module that reports them.
+# 'source' labels the pipeline or stream a frame belongs to.
+FRAMES_DECODED = REGISTRY.counter('mhds_frames_decoded_total', "Frames read from a video source")
+FRAMES_PROCESSED = REGISTRY.counter('mhds_frames_processed_total',
+                                    "Frames that went through the detection stage, whether "
+                                    "a model ran on them or their detections were reused")
+FRAMES_DROPPED = REGISTRY.counter('mhds_frames_dropped_total',
+                                  "Frames discarded by a full queue, by queue")
+FRAMES_SKIPPED = REGISTRY.counter('mhds_frames_skipped_total',
+                                  "Frames whose detections were reused instead of inferred, "
+                                  "by reason")
+QUEUE_DEPTH = REGISTRY.gauge('mhds_queue_depth', "Frames waiting in a pipeline queue")
+INFERENCE_SECONDS = REGISTRY.histogram('mhds_inference_seconds',
+                                       "Time of one model call, by model")
+INFERENCE_FRAMES = REGISTRY.counter('mhds_inference_frames_total', "Frames run through each model")
+LATENCY_SECONDS = REGISTRY.histogram('mhds_latency_seconds',
+                                     "Time from decoding a frame to its annotated result")
+
+
+class MetricsServer:
+    # Serves the registry at /metrics (Prometheus text) and /metrics.json
+    # from a background thread, on every interface by default so that a
+    # scraper can reach each box
+    def __init__(self, registry=REGISTRY, host='0.0.0.0', port=9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = registry.render().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(registry.snapshot(), indent=2).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        # The actual port, in case 0 was given
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True,
+                         name='metrics-server').start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def serve(port=9108, host='0.0.0.0'):
+    # Starts the endpoint, or reports why it could not (e.g. port in use).
+    # host='127.0.0.1' keeps it local to the machine.
+    try:
+        server = MetricsServer(REGISTRY, host, port).start()
+    except OSError as e:
+        print(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    shown = socket.gethostname() if host in ('', '0.0.0.0') else host
+    print(f"Metrics at http://{shown}:{server.port}/metrics")
+    return server
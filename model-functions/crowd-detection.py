@@ -20,26 +20,25 @@ while cap.isOpened():
     # Initialize counter for this frame
     person_count = 0
     
+    # Pull all boxes to the host in one transfer and threshold them at once
+    boxes = results[0].boxes.data.cpu().numpy()
+    boxes = boxes[boxes[:, 4] > 0.3]
+    xyxy = boxes[:, :4].astype(int).tolist()
+    confidences = boxes[:, 4].tolist()
+    class_ids = boxes[:, 5].astype(int).tolist()
+    
     # Process each detection
-    for idx, result in enumerate(results[0].boxes):
-        # Get box coordinates
-        x1, y1, x2, y2 = map(int, result.xyxy[0])
+    for (x1, y1, x2, y2), confidence, class_id in zip(xyxy, confidences, class_ids):
+        # Increment counter
+        person_count += 1
         
-        # Get confidence and class
-        confidence = float(result.conf[0])
-        class_id = int(result.cls[0])
+        # Draw box
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (255,0,0), 1)
         
-        if confidence > 0.3:  # Confidence threshold
-            # Increment counter
-            person_count += 1
-            
-            # Draw box
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (255,0,0), 1)
-            
-            # Add count label for each box
-            box_label = f'{person_count}'
-            # cvzone.putTextRect(frame, box_label, (x1, y1 - 10), scale=1, thickness=1,colorR=(255,0,255), colorB=(0,0,0))
-            cv2.putText(frame, box_label, (x1+10, y1+20), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1)
+        # Add count label for each box
+        box_label = f'{person_count}'
+        # cvzone.putTextRect(frame, box_label, (x1, y1 - 10), scale=1, thickness=1,colorR=(255,0,255), colorB=(0,0,0))
+        cv2.putText(frame, box_label, (x1+10, y1+20), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1)
     
     # Add total count in top left corner
     total_label = f'People Count: {person_count}'
@@ -19,26 +19,26 @@ while cap.isOpened():
     # Run inference on the frame
     results = model(frame)
     
+    # Pull all boxes to the host in one transfer and threshold them at once
+    boxes = results[0].boxes.data.cpu().numpy()
+    boxes = boxes[boxes[:, 4] > 0.2]
+    xyxy = boxes[:, :4].astype(int).tolist()
+    confidences = boxes[:, 4].tolist()
+    class_ids = boxes[:, 5].astype(int).tolist()
+    
     # Process each detection
-    for result in results[0].boxes:
-        # Get box coordinates
-        x1, y1, x2, y2 = map(int, result.xyxy[0])
-        
-        # Get confidence and class
-        confidence = float(result.conf[0])
-        class_id = int(result.cls[0])
+    for (x1, y1, x2, y2), confidence, class_id in zip(xyxy, confidences, class_ids):
         class_name = model.names[class_id]
         
-        if confidence > 0.2:  # Confidence threshold
-            # Draw box
-            # cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 1)
-            
-            cvzone.cornerRect(frame, (x1, y1, x2 - x1, y2 - y1), l=5,t=3, rt=1, colorC=(0, 0, 255), colorR=(0, 165, 255))
-            
-            # Add label
-            label = f'{class_name.upper()} {confidence*100:.1f}%'
-            cv2.putText(frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
-            cvzone.putTextRect(frame, label, (x1, y1 - 10), 0.8, 1, (255, 255, 255), (0, 0, 255), colorB=(0, 255, 0))
+        # Draw box
+        # cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 1)
+        
+        cvzone.cornerRect(frame, (x1, y1, x2 - x1, y2 - y1), l=5,t=3, rt=1, colorC=(0, 0, 255), colorR=(0, 165, 255))
+        
+        # Add label
+        label = f'{class_name.upper()} {confidence*100:.1f}%'
+        cv2.putText(frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+        cvzone.putTextRect(frame, label, (x1, y1 - 10), 0.8, 1, (255, 255, 255), (0, 0, 255), colorB=(0, 255, 0))
     
     # Display the frame
     cv2.imshow("YOLOv11 Detection", frame)
@@ -41,39 +41,39 @@ while cap.isOpened():
     # Run inference on the frame
     results = model(frame)
     
+    # Pull all boxes to the host in one transfer and threshold them at once
+    boxes = results[0].boxes.data.cpu().numpy()
+    boxes = boxes[boxes[:, 4] > 0.4]
+    xyxy = boxes[:, :4].astype(int).tolist()
+    confidences = boxes[:, 4].tolist()
+    class_ids = boxes[:, 5].astype(int).tolist()
+    
     # Process each detection
-    for result in results[0].boxes:
-        # Get box coordinates
-        x1, y1, x2, y2 = map(int, result.xyxy[0])
-        
-        # Get confidence and class
-        confidence = float(result.conf[0])
-        class_id = int(result.cls[0])
+    for (x1, y1, x2, y2), confidence, class_id in zip(xyxy, confidences, class_ids):
         class_name = model.names[class_id]
         
-        if confidence > 0.4:  # Confidence threshold
-            # Get color for the detected class
-            color = class_colors.get(class_name.lower(), DEFAULT_COLOR)
-            
-            # Draw box with class-specific color
-            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-            
-            # Add label with matching color
-            label = f'{class_name} {confidence*100:.2f}%'
-            
-            # Calculate optimal text position
-            text_y = max(y1 - 10, 20)  # Ensure text doesn't go above frame
-            
-            # Create background for text that matches vehicle class color
-            cvzone.putTextRect(frame, 
-                             label, 
-                             (x1, text_y), 
-                             scale=0.8,  # Slightly smaller text for better fit
-                             thickness=1,
-                             colorR=color,          # Rectangle color
-                             colorT=(255, 255, 255),  # Text color (white)
-                             offset=5,              # Padding around text
-                             border=2)              # Border thickness
+        # Get color for the detected class
+        color = class_colors.get(class_name.lower(), DEFAULT_COLOR)
+        
+        # Draw box with class-specific color
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        
+        # Add label with matching color
+        label = f'{class_name} {confidence*100:.2f}%'
+        
+        # Calculate optimal text position
+        text_y = max(y1 - 10, 20)  # Ensure text doesn't go above frame
+        
+        # Create background for text that matches vehicle class color
+        cvzone.putTextRect(frame, 
+                         label, 
+                         (x1, text_y), 
+                         scale=0.8,  # Slightly smaller text for better fit
+                         thickness=1,
+                         colorR=color,          # Rectangle color
+                         colorT=(255, 255, 255),  # Text color (white)
+                         offset=5,              # Padding around text
+                         border=2)              # Border thickness
     
     # Add legend to the frame
     legend_y = 30
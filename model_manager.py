@@ -0,0 +1,136 @@
+import os
+import threading
+from collections import OrderedDict
+
+from backends import TORCH, artifact_path, model_files, model_path, resolve_backend
+
+
+def load_yolo(spec):
+    # Imported here so that creating the manager does not pay the
+    # ultralytics/torch import cost until the first model is needed
+    from ultralytics import YOLO
+    return YOLO(model_path(spec), task=spec['task'])
+
+
+class ModelManager:
+    def __init__(self, specs, max_models=None, max_bytes=None, loader=None):
+        self.specs = specs
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.loader = loader or load_yolo
+
+        # Resident models, least recently used first
+        self._models = OrderedDict()
+        self._sizes = {}
+        # What each model is loaded from, see path()
+        self._paths = {}
+        # Loads in progress, so concurrent requests wait instead of loading twice
+        self._loading = {}
+        self._lock = threading.RLock()
+
+    def get(self, name):
+        while True:
+            with self._lock:
+                if name in self._models:
+                    self._models.move_to_end(name)
+                    return self._models[name]
+
+                event = self._loading.get(name)
+                owner = event is None
+                if owner:
+                    event = threading.Event()
+                    self._loading[name] = event
+
+            if not owner:
+                # Another thread is loading it; re-check once it is done
+                event.wait()
+                continue
+
+            try:
+                model = self.loader(self.specs[name])
+            except Exception:
+                with self._lock:
+                    del self._loading[name]
+                event.set()
+                raise
+
+            with self._lock:
+                self._models[name] = model
+                self._sizes[name] = self.model_size(name)
+                del self._loading[name]
+                self._evict(keep=name)
+            event.set()
+            return model
+
+    def prefetch(self, name):
+        with self._lock:
+            if name in self._models or name in self._loading:
+                return
+
+        def load():
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"Failed to prefetch {name} model: {e}")
+
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+
+    def is_loaded(self, name):
+        with self._lock:
+            return name in self._models
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    def unload(self, name):
+        with self._lock:
+            self._models.pop(name, None)
+            self._sizes.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._sizes.clear()
+
+    def path(self, name):
+        # The file (or OpenVINO directory) the model is loaded from with its
+        # spec's backend, exported the first time if needed
+        with self._lock:
+            path = self._paths.get(name)
+        if path is None:
+            path = model_path(self.specs[name])
+            with self._lock:
+                self._paths[name] = path
+        return path
+
+    def model_size(self, name):
+        # The size on disk of what the model is loaded from (the .pt, ONNX,
+        # INT8 or OpenVINO files of its backend) is a cheap stand-in for the
+        # resident size; nothing is exported just to measure it
+        spec = self.specs[name]
+        with self._lock:
+            path = self._paths.get(name)
+        try:
+            if path is None:
+                path = artifact_path(spec['path'], resolve_backend(spec.get('backend', TORCH)))
+            return sum(os.path.getsize(f) for f in model_files(path))
+        except (OSError, ValueError):
+            return 0
+
+    def resident_bytes(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def _evict(self, keep):
+        # Drop least recently used models until we are back within budget,
+        # never evicting the model that was just requested
+        while len(self._models) > 1:
+            over_count = self.max_models is not None and len(self._models) > self.max_models
+            over_bytes = self.max_bytes is not None and self.resident_bytes() > self.max_bytes
+            if not (over_count or over_bytes):
+                break
+
+            victim = next(name for name in self._models if name != keep)
+            self.unload(victim)
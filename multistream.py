@@ -0,0 +1,294 @@
+import argparse
+import os
+import threading
+import time
+
+import cv2
+from metrics import FRAMES_DECODED, FRAMES_PROCESSED, LATENCY_SECONDS, serve
+from pipeline import DROP_OLDEST, FramePacket, FrameQueue
+from prototype1 import MODES, UnifiedDetectionSystem
+
+
+class StreamSource:
+    # One camera, file or stream URL. A decoder thread keeps only the newest
+    # frame in a single slot, so a stream that produces frames faster than
+    # they are inferred drops its own stale frames instead of queueing up.
+    def __init__(self, name, source, modes='all', realtime=None, loop=False):
+        self.name = name
+        self.source = source
+        self.modes = modes
+        self.loop = loop
+        # Files are paced to their frame rate so they behave like cameras;
+        # live sources are paced by the device itself
+        self.realtime = (isinstance(source, str) and os.path.isfile(source)
+                         if realtime is None else realtime)
+
+        self.cap = None
+        self.fps = 0
+        self.pending = FrameQueue(1, DROP_OLDEST, {'source': name, 'queue': 'pending'})
+        self.output = FrameQueue(2, DROP_OLDEST, {'source': name, 'queue': 'output'})
+        self.finished = False
+
+        # Statistics, updated by the decoder and the scheduler
+        self.decoded = 0
+        self.processed = 0
+        self.last_served = 0.0
+        self.latency = None
+        self._fps_window = []
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._notify = None
+
+    @property
+    def dropped(self):
+        return self.pending.dropped
+
+    def start(self, notify=None):
+        self._notify = notify
+        self.cap = cv2.VideoCapture(self.source)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open stream {self.name}: {self.source}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._decode_loop, daemon=True,
+                                        name=f'stream-{self.name}')
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        self.pending.close()
+        self.output.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.cap is not None:
+            self.cap.release()
+
+    def read(self, timeout=None):
+        # Latest result when no on_result callback is given to the engine
+        return self.output.get(timeout)
+
+    def take(self):
+        return self.pending.get(timeout=0)
+
+    def record(self, packet, now):
+        # Called by the scheduler once the packet has been annotated
+        self.processed += 1
+        self.last_served = now
+        latency = now - packet.decoded_at
+        FRAMES_PROCESSED.inc(source=self.name)
+        LATENCY_SECONDS.observe(latency, source=self.name)
+        self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+        self._fps_window.append(now)
+        while self._fps_window and now - self._fps_window[0] > 2.0:
+            self._fps_window.pop(0)
+
+    def stats(self):
+        window = self._fps_window
+        span = window[-1] - window[0] if len(window) > 1 else 0
+        return {
+            'stream': self.name,
+            'decoded': self.decoded,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'fps': (len(window) - 1) / span if span else 0.0,
+            'latency_ms': self.latency * 1000 if self.latency is not None else None,
+        }
+
+    def _decode_loop(self):
+        clock_start = time.perf_counter()
+        clock_frames = 0
+        while not self._stop.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                if self.loop and self.realtime:
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    clock_start = time.perf_counter()
+                    clock_frames = 0
+                    continue
+                break
+
+            index = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) - 1
+            timestamp = index / self.fps if self.fps else 0
+            self.pending.put(FramePacket(index, timestamp, frame))
+            self.decoded += 1
+            FRAMES_DECODED.inc(source=self.name)
+            if self._notify:
+                self._notify()
+
+            if self.realtime and self.fps:
+                clock_frames += 1
+                delay = clock_start + clock_frames / self.fps - time.perf_counter()
+                if delay > 0:
+                    self._stop.wait(delay)
+        self.finished = True
+        if self._notify:
+            self._notify()
+
+
+class MultiStreamEngine:
+    # Many streams share one UnifiedDetectionSystem, i.e. one instance of
+    # each model. A single scheduler thread collects the newest frame of
+    # each stream, runs every model once over the frames that need it and
+    # routes the annotated results back to their streams.
+    def __init__(self, detector=None, batch_size=8, on_result=None):
+        self.detector = detector or UnifiedDetectionSystem()
+        self.batch_size = batch_size
+        self.on_result = on_result
+        self.streams = {}
+        self.batches = 0
+
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_stream(self, name, source, modes='all', **kwargs):
+        stream = StreamSource(name, source, modes, **kwargs)
+        self.streams[name] = stream
+        if self.running:
+            stream.start(self._ready.set)
+        return stream
+
+    def remove_stream(self, name):
+        stream = self.streams.pop(name)
+        stream.stop()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        for stream in self.streams.values():
+            stream.start(self._ready.set)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._schedule_loop, daemon=True,
+                                        name='stream-scheduler')
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        self._ready.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        for stream in list(self.streams.values()):
+            stream.stop(timeout)
+
+    def stats(self):
+        return [stream.stats() for stream in list(self.streams.values())]
+
+    def next_batch(self):
+        # Fairness: streams that were served least recently go first and
+        # each stream contributes at most its newest frame per batch, so a
+        # busy stream cannot push the others out
+        streams = sorted(self.streams.values(), key=lambda s: s.last_served)
+        batch = []
+        for stream in streams:
+            if len(batch) == self.batch_size:
+                break
+            packet = stream.take()
+            if packet is not None:
+                batch.append((stream, packet))
+        return batch
+
+    def run_batch(self, batch):
+        detector = self.detector
+        # Group the frames by model so that every model runs once per batch
+        wanted = {}
+        for i, (stream, _) in enumerate(batch):
+            for mode in detector.resolve_modes(stream.modes):
+                wanted.setdefault(mode, []).append(i)
+        modes = tuple(m for m in MODES if m in wanted)
+
+        def infer(mode):
+            frames = [batch[i][1].frame for i in wanted[mode]]
+            return dict(zip(wanted[mode], detector.infer_batch(mode, frames)))
+        try:
+            results = detector.map_modes(infer, modes)
+        finally:
+            detector.preprocessor.release()
+
+        now = time.perf_counter()
+        for i, (stream, packet) in enumerate(batch):
+            packet.detections = {mode: results[mode][i] for mode in modes if i in results[mode]}
+            # Drawn on the decoded frame itself: nothing downstream needs the
+            # raw pixels, and a copy per frame and stream adds up
+            packet.annotated = detector.annotate(packet.frame, packet.detections)
+            detector.add_model_indicator(packet.annotated, stream.modes)
+            stream.record(packet, now)
+            if self.on_result:
+                self.on_result(stream, packet)
+            else:
+                stream.output.put(packet)
+        self.batches += 1
+
+    def _schedule_loop(self):
+        while not self._stop.is_set():
+            # Cleared before collecting so a frame that arrives meanwhile
+            # still wakes the next wait
+            self._ready.clear()
+            batch = self.next_batch()
+            if batch:
+                self.run_batch(batch)
+            elif self.streams and all(s.finished for s in list(self.streams.values())):
+                break
+            else:
+                self._ready.wait(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-stream Hazard Detection")
+    parser.add_argument('sources', nargs='+',
+                        help="Video files, webcam indices or stream URLs")
+    parser.add_argument('-m', '--modes', nargs='+', default=['all'],
+                        help="Detection modes to run on every stream, or 'all'")
+    parser.add_argument('-b', '--batch-size', type=int, default=8)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--loop', action='store_true', help="Replay files when they end")
+    parser.add_argument('--show', action='store_true', help="Display every stream in a window")
+    parser.add_argument('--metrics-port', type=int, default=9108,
+                        help="Port of the metrics endpoint (0 to disable)")
+    parser.add_argument('--metrics-host', default='0.0.0.0',
+                        help="Address the metrics endpoint listens on "
+                             "(default: every interface; 127.0.0.1 keeps it local)")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        serve(args.metrics_port, args.metrics_host)
+
+    detector = UnifiedDetectionSystem()
+    detector.predict_args = {'device': args.device, 'verbose': False}
+    engine = MultiStreamEngine(detector, args.batch_size)
+    modes = 'all' if args.modes == ['all'] else args.modes
+    for i, source in enumerate(args.sources):
+        engine.add_stream(f'cam{i}', int(source) if source.isdigit() else source, modes,
+                          loop=args.loop)
+    engine.start()
+
+    last_report = time.perf_counter()
+    try:
+        while engine.running:
+            if args.show:
+                for stream in engine.streams.values():
+                    packet = stream.read(timeout=0)
+                    if packet is not None:
+                        cv2.imshow(stream.name, packet.annotated)
+                if cv2.waitKey(10) & 0xFF == ord('q'):
+                    break
+            else:
+                time.sleep(0.1)
+
+            if time.perf_counter() - last_report >= 2.0:
+                last_report = time.perf_counter()
+                for s in engine.stats():
+                    latency = f"{s['latency_ms']:.0f} ms" if s['latency_ms'] is not None else '-'
+                    print(f"{s['stream']}: {s['fps']:.1f} fps, latency {latency}, "
+                          f"{s['processed']}/{s['decoded']} frames, {s['dropped']} dropped")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop()
+        cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
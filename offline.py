@@ -0,0 +1,411 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+from backends import BACKENDS, RUNTIMES, is_available
+from detection_cache import CachedDetector, DetectionCache
+from prototype1 import MODES, UnifiedDetectionSystem
+
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.webm'}
+
+
+def read_batches(cap, batch_size, max_frames=None):
+    # Yields lists of (frame index, frame) of up to batch_size frames
+    batch = []
+    index = 0
+    while max_frames is None or index < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        batch.append((index, frame))
+        index += 1
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def print_progress(input_path, frames_done, total, elapsed):
+    print(f"\r{input_path}: {frames_done}/{total} frames "
+          f"({frames_done / elapsed:.1f} fps)", end="", flush=True)
+
+
+def process_video_file(detector, input_path, output_path=None, modes='all', batch_size=8,
+                       detections_path=None, progress=print_progress):
+    # Runs detection over a whole file without any window, in batches of
+    # batch_size frames. Optionally writes the annotated video and one JSON
+    # line of detections per frame.
+    cap = cv2.VideoCapture(str(input_path))
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video: {input_path}")
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    writer = None
+    detections_file = open(detections_path, 'w') if detections_path else None
+
+    frames_done = 0
+    start = time.perf_counter()
+    try:
+        for batch in read_batches(cap, batch_size):
+            outputs = detector.detect_batch([frame for _, frame in batch], modes,
+                                            [index for index, _ in batch])
+
+            for (index, _), (frame, detections) in zip(batch, outputs):
+                if output_path:
+                    if writer is None:
+                        height, width = frame.shape[:2]
+                        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                        writer = cv2.VideoWriter(str(output_path), fourcc, fps, (width, height))
+                    writer.write(frame)
+                if detections_file:
+                    for detection in detections:
+                        detection['confidence'] = round(detection['confidence'], 4)
+                    detections_file.write(json.dumps({
+                        'frame': index,
+                        'time': round(index / fps, 3),
+                        'detections': detections,
+                    }) + '\n')
+
+            frames_done += len(batch)
+            if progress:
+                progress(input_path, frames_done, total, time.perf_counter() - start)
+    finally:
+        if progress is print_progress:
+            print()
+        cap.release()
+        if writer is not None:
+            writer.release()
+        if detections_file:
+            detections_file.close()
+
+    elapsed = time.perf_counter() - start
+    return {'frames': frames_done, 'seconds': elapsed,
+            'fps': frames_done / elapsed if elapsed else 0.0}
+
+
+def benchmark_batch_sizes(detector, input_path, modes='all', batch_sizes=(1, 2, 4, 8, 16),
+                          max_frames=64):
+    # Frames are decoded up front so only inference and drawing are timed
+    cap = cv2.VideoCapture(input_path)
+    frames = [frame for batch in read_batches(cap, max_frames, max_frames)
+              for _, frame in batch]
+    cap.release()
+    if not frames:
+        raise IOError(f"No frames could be read from {input_path}")
+
+    # Warm up every model so loading is not counted against the first size
+    detector.detect_batch([frames[0].copy()], modes)
+
+    results = []
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, len(frames), batch_size):
+            detector.detect_batch([f.copy() for f in frames[i:i + batch_size]], modes)
+        elapsed = time.perf_counter() - start
+        results.append((batch_size, len(frames) / elapsed))
+    return results
+
+
+# Batch jobs: every input file is processed by one worker process, which
+# loads its own models once. A job writes <name>.annotated.mp4 and
+# <name>.detections.jsonl under temporary names and only renames them and
+# writes <name>.done.json when the whole file is finished, so an interrupted
+# run can be restarted and skips the files that are already complete.
+
+def expand_inputs(inputs):
+    # (path, name) per video. Files found in a folder are named by their
+    # path relative to it (cam1/clip), so that same-named files in different
+    # subfolders get separate outputs; a name that is still taken gets a
+    # short hash of the absolute path appended.
+    jobs, names, seen = [], set(), set()
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            found = [(p, p.relative_to(path).with_suffix('').as_posix())
+                     for p in sorted(path.rglob('*')) if p.suffix.lower() in VIDEO_EXTENSIONS]
+        else:
+            found = [(path, path.stem)]
+        for video, name in found:
+            if video.resolve() in seen:
+                continue
+            seen.add(video.resolve())
+            if name in names:
+                digest = hashlib.blake2b(str(video.resolve()).encode(), digest_size=4)
+                name = f"{name}.{digest.hexdigest()}"
+            names.add(name)
+            jobs.append((video, name))
+    return jobs
+
+
+def job_outputs(name, output_dir):
+    stem = Path(output_dir) / name
+    return {
+        'video': stem.with_name(stem.name + '.annotated.mp4'),
+        'detections': stem.with_name(stem.name + '.detections.jsonl'),
+        'done': stem.with_name(stem.name + '.done.json'),
+    }
+
+
+def source_signature(input_path):
+    stat = os.stat(input_path)
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def is_complete(input_path, outputs, settings):
+    try:
+        with open(outputs['done']) as f:
+            done = json.load(f)
+        source = source_signature(input_path)
+    except (OSError, ValueError):
+        return False
+    # Every output the settings ask for must still be there
+    expected = ['detections'] + (['video'] if settings.get('write_video', True) else [])
+    return (done.get('source') == source and done.get('settings') == settings
+            and all(outputs[key].exists() for key in expected))
+
+
+worker_detector = None
+worker_progress = None
+
+
+def make_detector(options=None):
+    # options: predict_args, tiled (modes run on tiles) and backends
+    # ('onnx' or {mode: backend}), as collected by main()
+    options = options or {}
+    detector = UnifiedDetectionSystem(backends=options.get('backends'))
+    detector.predict_args = dict(options.get('predict_args', {}))
+    detector.tiled_modes = set(options.get('tiled', ()))
+    return detector
+
+
+def init_worker(options, progress_queue, cache_path=None):
+    global worker_detector, worker_progress
+    worker_detector = make_detector(options)
+    if cache_path:
+        # Frames already analyzed with the same models only cost decode and drawing
+        worker_detector = CachedDetector(worker_detector, DetectionCache(cache_path))
+    worker_progress = progress_queue
+
+
+def run_job(input_path, name, output_dir, settings, write_video):
+    outputs = job_outputs(name, output_dir)
+    os.makedirs(outputs['done'].parent, exist_ok=True)
+    # The writer picks its container from the extension, so keep it last
+    partial = {key: path.with_name(path.stem + '.partial' + path.suffix)
+               for key, path in outputs.items()}
+
+    def report(path, frames_done, total, elapsed):
+        worker_progress.put((str(input_path), frames_done, total))
+
+    if isinstance(worker_detector, CachedDetector):
+        worker_detector.set_video(input_path)
+    stats = process_video_file(worker_detector, input_path,
+                               partial['video'] if write_video else None,
+                               settings['modes'], settings['batch_size'],
+                               partial['detections'], report)
+    if isinstance(worker_detector, CachedDetector):
+        worker_detector.cache.flush()
+
+    if write_video:
+        os.replace(partial['video'], outputs['video'])
+    os.replace(partial['detections'], outputs['detections'])
+    with open(outputs['done'], 'w') as f:
+        json.dump({'source': source_signature(input_path), 'settings': settings,
+                   'stats': stats}, f, indent=2)
+    return stats
+
+
+def run_batch(inputs, output_dir, modes='all', batch_size=8, workers=1, options=None,
+              write_video=True, force=False, cache_path=None):
+    os.makedirs(output_dir, exist_ok=True)
+    options = options or {}
+    settings = {'modes': modes, 'batch_size': batch_size,
+                'tiled': sorted(options.get('tiled', ())), 'backends': options.get('backends'),
+                'write_video': write_video}
+
+    pending = []
+    for input_path, name in expand_inputs(inputs):
+        if not force and is_complete(input_path, job_outputs(name, output_dir), settings):
+            print(f"Skipping {input_path} (already processed)")
+        else:
+            pending.append((input_path, name))
+    if not pending:
+        return {}
+
+    manager = multiprocessing.Manager()
+    progress_queue = manager.Queue()
+    frames = {str(p): 0 for p, _ in pending}
+    results = {}
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(options, progress_queue, cache_path)) as pool:
+        futures = {pool.submit(run_job, p, name, output_dir, settings, write_video): str(p)
+                   for p, name in pending}
+        remaining = set(futures)
+        while remaining:
+            # Drain progress updates and show the aggregate throughput
+            try:
+                while True:
+                    path, frames_done, _ = progress_queue.get(timeout=0.5)
+                    frames[path] = frames_done
+            except queue.Empty:
+                pass
+            elapsed = time.perf_counter() - start
+            total_frames = sum(frames.values())
+            print(f"\r[{len(results)}/{len(pending)} files] {total_frames} frames, "
+                  f"{total_frames / elapsed:.1f} fps", end="", flush=True)
+
+            for future in [f for f in remaining if f.done()]:
+                remaining.discard(future)
+                path = futures[future]
+                try:
+                    results[path] = future.result()
+                    print(f"\nFinished {path}: {results[path]['frames']} frames "
+                          f"at {results[path]['fps']:.1f} fps")
+                except Exception as e:
+                    results[path] = None
+                    print(f"\nFailed {path}: {e}")
+    print()
+    manager.shutdown()
+    return results
+
+
+def benchmark_backends(input_path, modes='all', backends=BACKENDS, max_frames=32,
+                       options=None):
+    # Per backend and mode: export/load time, single-frame frames/sec and
+    # detections per frame, so speed and agreement can be compared
+    cap = cv2.VideoCapture(input_path)
+    frames = [frame for batch in read_batches(cap, max_frames, max_frames)
+              for _, frame in batch]
+    cap.release()
+    if not frames:
+        raise IOError(f"No frames could be read from {input_path}")
+
+    results = []
+    for backend in backends:
+        if not is_available(backend):
+            print(f"Skipping {backend}: {RUNTIMES[backend]} is not installed")
+            continue
+        detector = make_detector(dict(options or {}, backends=backend))
+        for mode in detector.resolve_modes(modes):
+            start = time.perf_counter()
+            try:
+                detector.infer(mode, frames[0])
+            except FileNotFoundError as e:
+                print(f"Skipping {backend} {mode}: {e}")
+                continue
+            load = time.perf_counter() - start
+
+            count = 0
+            start = time.perf_counter()
+            for frame in frames:
+                count += len(detector.infer(mode, frame))
+            elapsed = time.perf_counter() - start
+            results.append((backend, mode, load, len(frames) / elapsed, count / len(frames)))
+        detector.models.clear()
+    return results
+
+
+def parse_backends(values):
+    # ['onnx'] -> 'onnx'; ['crowd=onnx', 'weapon=openvino'] -> {mode: backend}.
+    # Raises ValueError on an unknown mode or backend, before any worker starts.
+    if not values:
+        return None
+    if len(values) == 1 and '=' not in values[0]:
+        pairs = None
+        chosen = values
+    else:
+        if not all('=' in value for value in values):
+            raise ValueError(f"expected one backend or MODE=BACKEND pairs, got {' '.join(values)}")
+        pairs = dict(value.split('=', 1) for value in values)
+        unknown = [mode for mode in pairs if mode not in MODES]
+        if unknown:
+            raise ValueError(f"unknown mode {unknown[0]!r}, expected one of {', '.join(MODES)}")
+        chosen = pairs.values()
+    for backend in chosen:
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    return values[0] if pairs is None else pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Multi Hazard Detection")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    process_parser = subparsers.add_parser('process', help="Annotate video files or folders")
+    process_parser.add_argument('inputs', nargs='+')
+    process_parser.add_argument('-o', '--output-dir', default='output')
+    process_parser.add_argument('-b', '--batch-size', type=int, default=8)
+    process_parser.add_argument('-w', '--workers', type=int, default=1,
+                                help="Number of files processed in parallel")
+    process_parser.add_argument('--no-video', action='store_true',
+                                help="Only export detections, skip the annotated video")
+    process_parser.add_argument('--force', action='store_true',
+                                help="Reprocess files that are already complete")
+    process_parser.add_argument('--cache', metavar='PATH',
+                                help="Detection cache file reused across runs")
+
+    bench_parser = subparsers.add_parser('bench', help="Compare frames/sec across batch sizes")
+    bench_parser.add_argument('input')
+    bench_parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    bench_parser.add_argument('--frames', type=int, default=64)
+
+    backends_parser = subparsers.add_parser('backends', help="Compare inference backends on CPU")
+    backends_parser.add_argument('input')
+    backends_parser.add_argument('--compare', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    backends_parser.add_argument('--frames', type=int, default=32)
+
+    for sub in (process_parser, bench_parser, backends_parser):
+        sub.add_argument('-m', '--modes', nargs='+', default=['all'],
+                         help="Detection modes to run, or 'all'")
+        sub.add_argument('--device', default='cpu')
+        sub.add_argument('--tiled', nargs='+', default=[], metavar='MODE',
+                         help="Modes run on overlapping tiles for small objects, e.g. crowd weapon")
+
+    for sub in (process_parser, bench_parser):
+        sub.add_argument('--backend', nargs='+', metavar='BACKEND',
+                         help=f"{', '.join(BACKENDS)} for every model, or MODE=BACKEND pairs")
+
+    args = parser.parse_args()
+    try:
+        backends = parse_backends(getattr(args, 'backend', None))
+    except ValueError as e:
+        parser.error(f"--backend: {e}")
+    modes = 'all' if args.modes == ['all'] else args.modes
+    predict_args = {'device': args.device, 'verbose': False}
+    options = {'predict_args': predict_args, 'tiled': args.tiled, 'backends': backends}
+
+    if args.command == 'process':
+        start = time.perf_counter()
+        results = run_batch(args.inputs, args.output_dir, modes, args.batch_size, args.workers,
+                            options, not args.no_video, args.force, args.cache)
+        done = [stats for stats in results.values() if stats]
+        frames = sum(stats['frames'] for stats in done)
+        elapsed = time.perf_counter() - start
+        print(f"Processed {len(done)}/{len(results)} files, {frames} frames in {elapsed:.1f}s "
+              f"({frames / elapsed if elapsed else 0:.1f} fps)")
+    elif args.command == 'bench':
+        detector = make_detector(options)
+        print(f"{'batch':>6} {'frames/sec':>12}")
+        for batch_size, fps in benchmark_batch_sizes(detector, args.input, modes,
+                                                     args.batch_sizes, args.frames):
+            print(f"{batch_size:>6} {fps:>12.2f}")
+    else:
+        print(f"{'backend':>9} {'mode':>8} {'load s':>8} {'frames/sec':>11} {'dets/frame':>11}")
+        for backend, mode, load, fps, per_frame in benchmark_backends(
+                args.input, modes, args.compare, args.frames, options):
+            print(f"{backend:>9} {mode:>8} {load:>8.2f} {fps:>11.2f} {per_frame:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
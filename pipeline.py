@@ -0,0 +1,375 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+from metrics import FRAMES_DECODED, FRAMES_DROPPED, FRAMES_PROCESSED, LATENCY_SECONDS, QUEUE_DEPTH
+
+# Queue policies: DROP_OLDEST keeps only the freshest frames (live viewing),
+# BLOCK applies back-pressure so that no frame is lost (offline processing)
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+# Commands handled by the decoder thread, see DetectionPipeline
+PLAY = 'play'
+PAUSE = 'pause'
+SEEK = 'seek'
+OPEN = 'open'
+SHOW = 'show'
+STOP = 'stop'
+
+
+class FrameQueue:
+    # labels (e.g. source and queue name) enable drop and depth metrics
+    def __init__(self, maxsize=2, policy=DROP_OLDEST, labels=None):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.labels = labels
+        self.dropped = 0
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, item):
+        with self._cond:
+            if self.policy == DROP_OLDEST:
+                while len(self._items) >= self.maxsize:
+                    self._items.popleft()
+                    self.dropped += 1
+                    if self.labels:
+                        FRAMES_DROPPED.inc(**self.labels)
+            else:
+                while len(self._items) >= self.maxsize and not self._closed:
+                    self._cond.wait()
+            if self._closed:
+                return False
+            self._items.append(item)
+            self._cond.notify_all()
+            if self.labels:
+                QUEUE_DEPTH.set(len(self._items), **self.labels)
+            return True
+
+    def get(self, timeout=None):
+        # Returns None on timeout or once the queue is closed and drained
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            if self.labels:
+                QUEUE_DEPTH.set(len(self._items), **self.labels)
+            return item
+
+    def clear(self):
+        with self._cond:
+            self._items.clear()
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+
+class FramePacket:
+    def __init__(self, index, timestamp, frame, source=None):
+        self.index = index
+        self.timestamp = timestamp
+        # What the frame was decoded from, so that later stages never
+        # attribute it to a source opened meanwhile
+        self.source = source
+        # Raw decoded BGR frame, left untouched by the later stages
+        self.frame = frame
+        self.annotated = None
+        # {mode: Detections} when the process stage leaves drawing to render
+        self.detections = None
+        # Whatever the render stage produced for display
+        self.image = None
+        self.decoded_at = time.perf_counter()
+
+
+class DetectionPipeline:
+    # Decoder, inference and render stages each run in their own thread and
+    # are connected by bounded queues, so decoding overlaps inference and the
+    # consumer always gets the most recent annotated frame.
+    #
+    # The decoder thread owns the capture and is driven by commands (play,
+    # pause, seek, open): it wakes up on the next command immediately and
+    # blocks on the command queue while paused. With keep_alive the threads
+    # outlive the end of the video and wait, paused, for the next command,
+    # so one pipeline can serve a whole GUI session.
+    def __init__(self, source=None, process=None, render=None, on_frame=None, on_end=None,
+                 queue_size=2, policy=DROP_OLDEST, realtime=True, name='pipeline',
+                 keep_alive=False, frame_cache=None):
+        self.process = process
+        self.render = render
+        self.on_frame = on_frame
+        self.on_end = on_end
+        self.realtime = realtime
+        self.keep_alive = keep_alive
+        # 'source' label of this pipeline's metrics
+        self.name = name
+
+        self.cap = None
+        self.source = None
+        self.fps = 0
+        self.frame_count = 0
+        # KeyframeIndex of the source, see keyframes.py; may be set from
+        # another thread once a background indexer is done
+        self.keyframes = None
+        # Optional FrameRing of recently decoded frames; seeks into it are
+        # replayed from the ring without touching the decoder
+        self.frame_cache = frame_cache
+        self._replay = None
+        self._show = False
+        self._owns_cap = False
+        if source is not None:
+            self._open(source)
+        self.decoded = FrameQueue(queue_size, policy, {'source': name, 'queue': 'decoded'})
+        self.inferred = FrameQueue(queue_size, policy, {'source': name, 'queue': 'inferred'})
+        # Only used when no on_frame callback is given, see read()
+        self.output = FrameQueue(queue_size, policy, {'source': name, 'queue': 'output'})
+
+        self.paused = False
+        self._commands = queue.Queue()
+        # Number of the latest seek, so that an older one can be abandoned
+        self._seeks = 0
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    @property
+    def dropped(self):
+        return self.decoded.dropped + self.inferred.dropped + self.output.dropped
+
+    def start(self, paused=False):
+        self.paused = paused
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._decode_loop, daemon=True),
+            threading.Thread(target=self._infer_loop, daemon=True),
+            threading.Thread(target=self._render_loop, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        self._commands.put((STOP,))
+        for q in (self.decoded, self.inferred, self.output):
+            q.close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def play(self):
+        self._commands.put((PLAY,))
+
+    def pause(self):
+        self._commands.put((PAUSE,))
+
+    def seek(self, frame_index):
+        # Reuses the open capture; works while paused as well
+        self._seeks += 1
+        self._commands.put((SEEK, frame_index, self._seeks))
+
+    def restart(self):
+        self.seek(0)
+        self.play()
+
+    def show(self, frame_index):
+        # Seeks and emits that one frame, also while paused (frame stepping)
+        self._seeks += 1
+        self._commands.put((SHOW, max(0, frame_index), self._seeks))
+
+    def open(self, source):
+        # Switches to another source (path, device index or capture) and
+        # pauses. Returns at once: opening a slow file or network stream is
+        # left to the decoder thread, and the returned Event is set once it
+        # is done. From then on fps, frame_count and is_open() describe the
+        # new source; wait on the Event, or poll it from a GUI main loop.
+        done = threading.Event()
+        self._commands.put((OPEN, source, done))
+        return done
+
+    def is_open(self):
+        cap = self.cap
+        return cap is not None and cap.isOpened()
+
+    def read(self, timeout=None):
+        return self.output.get(timeout)
+
+    def _open(self, source):
+        if self._owns_cap and self.cap is not None and self.cap is not source:
+            self.cap.release()
+        self._owns_cap = not isinstance(source, cv2.VideoCapture)
+        self.cap = cv2.VideoCapture(source) if self._owns_cap else source
+        self.source = source
+        self.keyframes = None
+        self._replay = None
+        if self.frame_cache is not None:
+            self.frame_cache.clear()
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def _apply(self, command):
+        kind = command[0]
+        if kind == PLAY:
+            self.paused = False
+        elif kind == PAUSE:
+            self.paused = True
+        elif kind in (SEEK, SHOW):
+            if self.cap is not None:
+                self._seek(command[1], command[2])
+            self._show = kind == SHOW
+            self.decoded.clear()
+            self.inferred.clear()
+        elif kind == OPEN:
+            try:
+                self._open(command[1])
+            finally:
+                self.paused = True
+                self.decoded.clear()
+                self.inferred.clear()
+                command[2].set()
+
+    def _seek(self, frame_index, seek_number):
+        if self.frame_cache is not None and frame_index in self.frame_cache:
+            self._replay = frame_index
+            return
+        self._replay = None
+
+        # With a keyframe index: jump to the keyframe preceding the target
+        # (or stay, when the target is ahead within the current GOP) and
+        # grab forward to it, instead of letting the backend guess
+        index = self.keyframes
+        if index is None or index.video_path != self.source:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+            return
+
+        keyframe = index.preceding(frame_index)
+        position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if not keyframe <= position <= frame_index:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+            position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        while position < frame_index:
+            # A newer seek (the next one while scrubbing) makes the rest of
+            # this one pointless
+            if seek_number != self._seeks or not self.cap.grab():
+                break
+            position += 1
+
+    def _read(self):
+        # Next (index, frame): replayed from the frame cache after a seek
+        # into it, decoded (and added to the cache) otherwise
+        if self._replay is not None:
+            index = self._replay
+            frame = self.frame_cache.get(index)
+            if frame is not None:
+                self._replay = index + 1
+                if self._replay == int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)):
+                    # Caught up with the decoder, which continues from here
+                    self._replay = None
+                return index, frame
+            # Past the cached frames (or evicted): decode from there
+            self._replay = None
+            self._seek(index, self._seeks)
+
+        ret, frame = self.cap.read()
+        if not ret:
+            return None, None
+        # Index of the frame just decoded (the capture already points past it)
+        index = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) - 1
+        FRAMES_DECODED.inc(source=self.name)
+        if self.frame_cache is not None:
+            self.frame_cache.put(index, frame)
+        return index, frame
+
+    def _decode_loop(self):
+        clock_start = time.perf_counter()
+        clock_frames = 0
+        command = None
+
+        while not self._stop.is_set():
+            if command is None:
+                # Blocks while paused, so a paused pipeline uses no CPU
+                block = (self.paused and not self._show) or self.cap is None
+                try:
+                    command = self._commands.get(block)
+                except queue.Empty:
+                    pass
+            if command is not None:
+                if command[0] == STOP:
+                    break
+                self._apply(command)
+                command = None
+                clock_start = time.perf_counter()
+                clock_frames = 0
+                continue
+
+            self._show = False
+            index, frame = self._read()
+            if frame is None:
+                if not self.keep_alive:
+                    break
+                self.paused = True
+                if self.on_end:
+                    self.on_end()
+                continue
+
+            timestamp = index / self.fps if self.fps else 0
+            self.decoded.put(FramePacket(index, timestamp, frame, self.source))
+
+            # Pace file playback to the source frame rate; slow stages then
+            # drop stale frames instead of slowing the video down. A command
+            # arriving meanwhile ends the wait.
+            if self.realtime and self.fps:
+                clock_frames += 1
+                delay = clock_start + clock_frames / self.fps - time.perf_counter()
+                if delay > 0:
+                    try:
+                        command = self._commands.get(timeout=delay)
+                    except queue.Empty:
+                        pass
+
+        self.decoded.close()
+        if self._owns_cap and self.cap is not None:
+            self.cap.release()
+        if not self._stop.is_set() and not self.keep_alive and self.on_end:
+            self.on_end()
+
+    def _infer_loop(self):
+        while True:
+            packet = self.decoded.get()
+            if packet is None:
+                break
+            if self.process:
+                packet.annotated = self.process(packet)
+                FRAMES_PROCESSED.inc(source=self.name)
+            if packet.annotated is None:
+                packet.annotated = packet.frame
+            self.inferred.put(packet)
+        self.inferred.close()
+
+    def _render_loop(self):
+        while True:
+            packet = self.inferred.get()
+            if packet is None:
+                break
+            if self.render:
+                packet.image = self.render(packet)
+            LATENCY_SECONDS.observe(time.perf_counter() - packet.decoded_at, source=self.name)
+            if self.on_frame:
+                self.on_frame(packet)
+            else:
+                self.output.put(packet)
+        self.output.close()
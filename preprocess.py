@@ -0,0 +1,123 @@
+import threading
+
+import cv2
+import numpy as np
+
+PAD_VALUE = 114
+
+
+class Letterbox:
+    # Geometry of one letterboxed frame, to map boxes back to the frame
+    def __init__(self, shape, scale, resized, pad):
+        self.shape = shape[:2]
+        self.scale = scale
+        self.resized = resized
+        self.pad = pad
+
+    @classmethod
+    def fit(cls, shape, size, stride=32, auto=True):
+        # Same arithmetic as the ultralytics LetterBox transform: scale to
+        # fit size, then pad to size (or only to a multiple of stride when
+        # auto) with the padding split between both sides
+        height, width = shape[:2]
+        scale = min(size / height, size / width)
+        new_w, new_h = int(round(width * scale)), int(round(height * scale))
+        dw, dh = size - new_w, size - new_h
+        if auto:
+            dw, dh = dw % stride, dh % stride
+        dw, dh = dw / 2, dh / 2
+        left, top = int(round(dw - 0.1)), int(round(dh - 0.1))
+        right, bottom = int(round(dw + 0.1)), int(round(dh + 0.1))
+        return cls(shape, scale, (new_w, new_h), (left, top, right, bottom))
+
+    @property
+    def input_shape(self):
+        left, top, right, bottom = self.pad
+        return self.resized[1] + top + bottom, self.resized[0] + left + right
+
+    def unmap(self, xyxy):
+        # Letterboxed input coordinates -> frame coordinates, clipped
+        left, top, _, _ = self.pad
+        boxes = (xyxy - np.float32([left, top, left, top])) / self.scale
+        height, width = self.shape
+        np.clip(boxes[:, 0::2], 0, width, out=boxes[:, 0::2])
+        np.clip(boxes[:, 1::2], 0, height, out=boxes[:, 1::2])
+        return boxes
+
+
+def to_tensor(array):
+    # Imported here like ultralytics itself, so that this module works
+    # (and falls back to plain frames) without torch
+    import torch
+    return torch.from_numpy(array)
+
+
+class Preprocessor:
+    # Letterboxes, converts BGR -> RGB and normalizes a frame (or a batch)
+    # once per model input size into a reused float32 buffer, and hands the
+    # same tensor to every model of that size running on the same frames.
+    # Tensors stay in use until release(); frames prepared meanwhile (other
+    # models running on other frames, as in MultiStreamEngine.run_batch)
+    # get a fresh batch rather than the reused one. With as_tensor=False
+    # the NumPy batch itself is returned.
+    def __init__(self, as_tensor=True):
+        self.as_tensor = as_tensor
+        self._buffers = {}
+        self._current = {}
+        self._lock = threading.Lock()
+
+    def prepare(self, frames, size):
+        # Returns ([Letterbox, ...], BCHW tensor) for the given frames
+        frames = tuple(frames)
+        with self._lock:
+            current = self._current.setdefault(size, [])
+            # Compared by identity; holding the frames keeps their ids unique
+            for held, letterboxes, tensor in current:
+                if len(held) == len(frames) and all(a is b for a, b in zip(held, frames)):
+                    return letterboxes, tensor
+
+            # Minimal padding only when every frame ends up the same shape
+            auto = len({frame.shape for frame in frames}) == 1
+            letterboxes = [Letterbox.fit(frame.shape, size, auto=auto) for frame in frames]
+            height, width = letterboxes[0].input_shape
+            if current:
+                # The reused buffer holds a tensor still in use
+                canvas, batch, tensor = self._allocate(len(frames), height, width)
+            else:
+                canvas, batch, tensor = self._buffer(size, len(frames), height, width)
+
+            for i, (frame, box) in enumerate(zip(frames, letterboxes)):
+                left, top, _, _ = box.pad
+                new_w, new_h = box.resized
+                canvas[:] = PAD_VALUE
+                roi = canvas[top:top + new_h, left:left + new_w]
+                if (new_w, new_h) == (frame.shape[1], frame.shape[0]):
+                    roi[:] = frame
+                else:
+                    cv2.resize(frame, (new_w, new_h), dst=roi, interpolation=cv2.INTER_LINEAR)
+                # HWC BGR uint8 -> CHW RGB float32 in [0, 1], straight into the batch
+                np.multiply(canvas.transpose(2, 0, 1)[::-1], np.float32(1 / 255), out=batch[i])
+
+            current.append((frames, letterboxes, tensor))
+            return letterboxes, tensor
+
+    def release(self):
+        # Called once every model has run on the prepared frames
+        with self._lock:
+            self._current.clear()
+
+    def _buffer(self, size, count, height, width):
+        # Per size as well, so models of different sizes running in
+        # parallel never share a buffer
+        key = (size, count, height, width)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            if len(self._buffers) > 8:
+                self._buffers.clear()
+            buffer = self._buffers[key] = self._allocate(count, height, width)
+        return buffer
+
+    def _allocate(self, count, height, width):
+        canvas = np.empty((height, width, 3), np.uint8)
+        batch = np.empty((count, 3, height, width), np.float32)
+        return canvas, batch, to_tensor(batch) if self.as_tensor else batch
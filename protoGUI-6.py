@@ -1,10 +1,18 @@
 import customtkinter as ctk
 import cv2
-from PIL import Image, ImageTk
 import threading
 from pathlib import Path
 from tkinter import filedialog
 from prototype1 import UnifiedDetectionSystem
+from pipeline import DROP_OLDEST, DetectionPipeline, FrameQueue
+from detection_cache import CachedDetector
+from gating import GatedDetector
+from tracking import StridedDetector
+from display import DisplaySurface, fit_size, resize_to, to_image
+from keyframes import KeyframeIndexer
+from frame_cache import FrameRing
+from thumbnails import ThumbnailJob
+from metrics import FRAMES_SKIPPED, serve
 from datetime import datetime
 import os
 import time
@@ -29,6 +37,21 @@ COLORS = {
     "accent_hover": "#00CC00"
 }
 
+# Tk widgets are only touched from the main loop: pipeline threads leave the
+# latest frame in a mailbox that a timer drains at about the display refresh
+# rate, while the time/frame/progress widgets are refreshed a few times a second
+DISPLAY_INTERVAL_MS = 16
+LABEL_INTERVAL = 0.25
+# Room left around the image so it never makes the video label grow
+DISPLAY_MARGIN = 8
+# Timeline previews: one thumbnail every THUMBNAIL_INTERVAL seconds
+THUMBNAIL_INTERVAL = 10.0
+THUMBNAIL_WIDTH = 160
+# Disk space for recently decoded frames, replayed on backward seeks and
+# frame steps (see frame_cache.py)
+FRAME_CACHE_PATH = "cache/frames.ring"
+FRAME_CACHE_BYTES = 1024 * 1024 * 1024
+
 class SystemMonitor:
     def __init__(self):
         self.gpu_available = 'GPUtil' in globals()
@@ -87,26 +110,80 @@ class HazardDetectionGUI:
         
         # Initialize detection system
         self.detector = UnifiedDetectionSystem()
+        # Same 'source' label as the pipeline's metrics below
+        self.detector.metrics_source = 'gui'
+        # Detections of frames seen before (seek back, restart, replay) are
+        # read from an on-disk cache instead of being inferred again
+        self.cached_detector = CachedDetector(self.detector)
+        # Video the cache is currently keyed on, see detect_frame
+        self.cached_source = None
+        # Reuses the last detections while the scene is static
+        self.gated_detector = GatedDetector(self.cached_detector)
+        # Runs the models every Nth frame and tracks boxes in between;
+        # the target rate is set from the video when playback starts
+        self.frame_detector = StridedDetector(self.gated_detector)
         
         # Video handling variables
         self.video_source = None
-        self.cap = None
+        # Set by the pipeline once the selected video is open, see wait_for_open
+        self.opening = None
         self.is_running = False
         self.current_mode = None
         self.detection_active = False
         self.video_playing = False
+        # Index of the frame on screen (or being sought to); stepping and
+        # the frame label both work from it
         self.current_frame_pos = 0
         
         self.video_duration = 0
         self.current_time = 0
         self.is_seeking = False
         
+        # Latest rendered frame, written by the pipeline and read by the main loop
+        self.mailbox = FrameQueue(1, DROP_OLDEST, {'source': 'gui', 'queue': 'display'})
+        self.video_finished = threading.Event()
+        self.last_label_update = 0
+        
+        # Frames are scaled to the video label once, on the render thread,
+        # and shown through one reused PhotoImage
+        self.display_size = None
+        self.surface = DisplaySurface()
+        # Nothing is recorded from the GUI, so boxes are drawn on the
+        # display-sized frame; False draws them on the full-resolution frame
+        self.annotate_at_display = True
+        # Recent frames with their detections (or annotated frames), so that
+        # going back neither decodes nor infers them again
+        self.frame_cache = FrameRing(FRAME_CACHE_PATH, FRAME_CACHE_BYTES,
+                                     annotated=not self.annotate_at_display)
+        
+        # One pipeline for the whole session: its decoder thread owns the
+        # capture and is driven by play/pause/seek/open commands
+        self.pipeline = DetectionPipeline(
+            process=self.detect_frame,
+            render=self.render_frame,
+            on_frame=self.show_frame,
+            on_end=self.video_finished.set,
+            name='gui',
+            keep_alive=True,
+            frame_cache=self.frame_cache
+        )
+        self.pipeline.start(paused=True)
+        # Builds (or loads) the keyframe index the pipeline seeks with, and
+        # the thumbnails shown when hovering over the progress bar
+        self.indexer = None
+        self.thumbnails = None
+        self.preview_surface = DisplaySurface()
+        
         # Create screenshots directory
         self.screenshot_dir = "screenshots"
         os.makedirs(self.screenshot_dir, exist_ok=True)
         
         self.create_gui()
         self.start_monitoring()
+        self.start_presenting()
+        
+        # Frame counters and latencies at http://<this machine>:9108/metrics
+        self.metrics_server = serve()
         
     def create_gui(self):
         # Create main container
@@ -196,12 +273,30 @@ class HazardDetectionGUI:
             self.gpu_label.configure(text=self.system_monitor.get_gpu_usage())
             self.temp_label.configure(text=self.system_monitor.get_cpu_temp())
             
+            if self.detection_active and self.video_playing:
+                stats = self.gated_detector.gate.stats()
+                self.update_status(f"Static frames skipped: {stats['skip_ratio']:.0%} "
+                                   f"(sensitivity {stats['sensitivity']:.1f}, "
+                                   f"refresh every {stats['refresh_interval']} video frames)")
+            
             # Schedule next update
             self.root.after(1000, update_monitoring)
         
         # Start the monitoring loop
         update_monitoring()
         
+    def start_presenting(self):
+        def present():
+            packet = self.mailbox.get(timeout=0)
+            if packet is not None:
+                self.present_frame(packet)
+            if self.video_finished.is_set():
+                self.video_finished.clear()
+                self.video_ended()
+            self.root.after(DISPLAY_INTERVAL_MS, present)
+        
+        present()
+        
     def create_left_sidebar(self):
         self.left_sidebar = ctk.CTkFrame(self.content_area, fg_color=COLORS["bg_medium"], width=320)
         self.left_sidebar.pack(side="left", fill="y", padx=(0, 10))
@@ -264,6 +359,11 @@ class HazardDetectionGUI:
         self.progress_bar.pack(fill="x", padx=15, pady=10)
         self.progress_bar.set(0)
         self.progress_bar.bind("<Button-1>", self.seek_video)
+        self.progress_bar.bind("<Motion>", self.show_preview)
+        self.progress_bar.bind("<Leave>", self.hide_preview)
+        
+        # Thumbnail of the hovered position, shown above the progress bar
+        self.preview_label = ctk.CTkLabel(controls_frame, text="")
         
         # Compact control buttons
         button_frame = ctk.CTkFrame(controls_frame, fg_color="transparent")
@@ -324,6 +424,10 @@ class HazardDetectionGUI:
             text_color=COLORS["text_secondary"]
         )
         self.video_label.pack(fill="both", expand=True, padx=20, pady=20)
+        self.video_label.bind("<Configure>", self.resize_display)
+        # Frame stepping, also while paused
+        self.root.bind("<Left>", lambda e: self.step_frame(-1))
+        self.root.bind("<Right>", lambda e: self.step_frame(1))
         
     def create_right_sidebar(self):
         self.right_sidebar = ctk.CTkFrame(self.content_area, fg_color=COLORS["bg_medium"], width=320)
@@ -347,7 +451,8 @@ class HazardDetectionGUI:
             ("🔥 Fire Detection", "fire"),
             ("🚬 Smoking Detection", "smoking"),
             ("🚗 Vehicle Detection", "vehicle"),
-            ("⚠️ Weapon Detection", "weapon")
+            ("⚠️ Weapon Detection", "weapon"),
+            ("🛡️ All Hazards", "all")
         ]
         
         for mode_text, mode_value in modes:
@@ -361,6 +466,19 @@ class HazardDetectionGUI:
                 text_color=COLORS["text_primary"]
             )
             btn.pack(pady=5, padx=15, fill="x")
+            # Start loading the model as soon as the operator hovers the mode
+            btn.bind("<Enter>", lambda e, m=mode_value: self.detector.prefetch(m))
+        
+        # Crowd and weapon detection on overlapping tiles of large frames
+        self.tiled_switch = ctk.CTkSwitch(
+            modes_frame,
+            text="Small-object mode (tiled)",
+            command=self.toggle_tiling,
+            font=("Roboto", 14),
+            progress_color=COLORS["accent"],
+            text_color=COLORS["text_primary"]
+        )
+        self.tiled_switch.pack(pady=(5, 10), padx=15, fill="x")
             
         # Detection control
         self.detection_btn = ctk.CTkButton(
@@ -412,19 +530,51 @@ class HazardDetectionGUI:
             filetypes=[("Video files", "*.mp4 *.avi *.mov")]
         )
         if file_path:
+            # Opening pauses the pipeline
+            if self.video_playing:
+                self.pause_video()
             self.video_source = file_path
             self.source_label.configure(text=Path(file_path).name)
             self.current_frame_pos = 0
-            self.load_video_info()
+            self.current_time = 0
+            # Unknown until the video is open
+            self.total_frames = 0
+            self.video_duration = 0
+            self.mailbox.clear()
+            self.opening = self.pipeline.open(file_path)
+            if self.indexer:
+                self.indexer.cancel()
+            if self.thumbnails:
+                self.thumbnails.cancel()
+            # Thumbnails start once the index tells them where keyframes are
+            thumbnails = ThumbnailJob(file_path, THUMBNAIL_INTERVAL, THUMBNAIL_WIDTH).start()
+            self.thumbnails = thumbnails
+            self.indexer = KeyframeIndexer(
+                file_path, lambda index: self.set_keyframes(index, thumbnails)).start()
+            self.wait_for_open(self.opening, Path(file_path).name)
+    
+    def wait_for_open(self, opening, name):
+        # Polled from the main loop until the decoder thread has opened the
+        # video, so that a slow source does not freeze the window
+        if opening is not self.opening:
+            # Another video was selected meanwhile
+            return
+        if not opening.is_set():
+            self.root.after(20, lambda: self.wait_for_open(opening, name))
+            return
+        if not self.pipeline.is_open():
+            self.update_status(f"Cannot open {name}")
+        self.load_video_info()
             
     def load_video_info(self):
+        # Read from the pipeline's capture rather than opening another one
         if self.video_source:
-            cap = cv2.VideoCapture(self.video_source)
-            self.video_duration = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) / cap.get(cv2.CAP_PROP_FPS))
-            self.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            cap.release()
+            fps = self.pipeline.fps
+            self.total_frames = self.pipeline.frame_count
+            self.video_duration = int(self.total_frames / fps) if fps else 0
             self.update_time_display()
             self.update_frame_display()
+            self.progress_bar.set(0)
             
     def update_time_display(self):
         current = self.format_time(self.current_time)
@@ -432,26 +582,70 @@ class HazardDetectionGUI:
         self.time_label.configure(text=f"{current} / {total}")
         
     def update_frame_display(self):
-        self.frame_label.configure(text=f"Frame: {self.current_frame_pos} / {self.total_frames}")
+        shown = min(self.current_frame_pos + 1, self.total_frames)
+        self.frame_label.configure(text=f"Frame: {shown} / {self.total_frames}")
         
     def format_time(self, seconds):
         return time.strftime('%H:%M:%S', time.gmtime(seconds))
     
     def seek_video(self, event):
         if self.video_source:
-            self.is_seeking = True
             x = event.x / self.progress_bar.winfo_width()
             self.current_time = x * self.video_duration
-            self.current_frame_pos = int(x * self.total_frames)
+            self.current_frame_pos = max(min(int(x * self.total_frames), self.total_frames - 1), 0)
             self.update_time_display()
             self.update_frame_display()
             self.progress_bar.set(x)
-            if self.cap:
-                self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_pos)
-            self.is_seeking = False
+            self.mailbox.clear()
+            self.pipeline.seek(self.current_frame_pos)
     
+    def step_frame(self, delta):
+        if self.video_source:
+            # Never past the last frame: the decoder would hit the end of
+            # the video and video_ended() would rewind it
+            target = max(self.current_frame_pos + delta, 0)
+            if self.total_frames:
+                target = min(target, self.total_frames - 1)
+            self.current_frame_pos = target
+            self.mailbox.clear()
+            self.pipeline.show(target)
+        
+    def set_keyframes(self, index, thumbnails):
+        # Called from the indexer thread; the pipeline ignores an index
+        # that does not belong to its current source
+        if index is not None:
+            self.pipeline.keyframes = index
+        thumbnails.use_keyframes(index)
+        
+    def show_preview(self, event):
+        if not (self.thumbnails and self.total_frames):
+            return
+        x = min(max(event.x / self.progress_bar.winfo_width(), 0), 1)
+        image = self.thumbnails.strip.nearest(int(x * self.total_frames))
+        if image is None:
+            return
+        if self.preview_surface.show(to_image(image)):
+            self.preview_label.configure(image=self.preview_surface.photo)
+            self.preview_label.image = self.preview_surface.photo
+        if not self.preview_label.winfo_ismapped():
+            self.preview_label.pack(before=self.progress_bar, pady=(5, 0))
+            
+    def hide_preview(self, event):
+        self.preview_label.pack_forget()
+        
+    def resize_display(self, event):
+        self.display_size = (max(1, event.width - DISPLAY_MARGIN),
+                             max(1, event.height - DISPLAY_MARGIN))
+        
+    def toggle_tiling(self):
+        if self.tiled_switch.get():
+            self.detector.tiled_modes = {'crowd', 'weapon'}
+        else:
+            self.detector.tiled_modes = set()
+        
     def set_detection_mode(self, mode):
         self.current_mode = mode
+        self.detector.prefetch(mode)
         
     def toggle_detection(self):
         if not self.video_playing:
@@ -475,36 +669,30 @@ class HazardDetectionGUI:
     def start_video(self):
         self.video_playing = True
         self.play_pause_btn.configure(text="⏸️")
-        
-        if self.cap is None:
-            self.cap = cv2.VideoCapture(self.video_source)
-            
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_pos)
-        
-        self.video_thread = threading.Thread(target=self.process_video)
-        self.video_thread.daemon = True
-        self.video_thread.start()
+        self.video_finished.clear()
+        self.frame_detector.stride.target_fps = self.pipeline.fps
+        # Resumes from where the decoder stopped
+        self.pipeline.play()
         
     def pause_video(self):
         self.video_playing = False
         self.play_pause_btn.configure(text="▶️")
+        self.pipeline.pause()
+        self.cached_detector.cache.flush()
+        # The throttled labels may lag the last frame shown
+        self.update_time_display()
+        self.update_frame_display()
         
     def restart_video(self):
+        # Seeks the open capture back to the start; keeps playing if it was
+        self.pipeline.seek(0)
+        self.mailbox.clear()
         self.current_frame_pos = 0
         self.current_time = 0
-        if self.cap:
-            self.cap.release()
-            self.cap = None
         
         self.update_time_display()
         self.update_frame_display()
         self.progress_bar.set(0)
-        
-        if self.video_playing:
-            self.start_video()
-        else:
-            self.cap = cv2.VideoCapture(self.video_source)
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
             
     def take_screenshot(self):
         if hasattr(self, 'current_frame') and self.current_frame is not None:
@@ -513,54 +701,100 @@ class HazardDetectionGUI:
             cv2.imwrite(filename, self.current_frame)
             print(f"Screenshot saved as {filename}")
             
-    def process_video(self):
-        while self.video_playing:
-            if self.is_seeking:
-                time.sleep(0.1)
-                continue
-            
-            ret, frame = self.cap.read()
-            if not ret:
-                self.video_playing = False
-                self.play_pause_btn.configure(text="▶️")
-                self.restart_video()
-                break
-            
-            self.current_frame_pos = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
-            self.current_time = self.current_frame_pos / self.cap.get(cv2.CAP_PROP_FPS)
+    def video_ended(self):
+        self.video_playing = False
+        self.play_pause_btn.configure(text="▶️")
+        self.restart_video()
             
+    # Pipeline stages: detect_frame runs on the inference thread,
+    # render_frame and show_frame on the render thread. None of them touch
+    # Tk; present_frame does, from the main loop.
+    def detect_frame(self, packet):
+        mode = self.current_mode
+        if not (self.detection_active and mode):
+            return packet.frame
+        # The detection cache follows the frames' source on this thread, so
+        # frames still in flight from the previous video are cached under
+        # that video, not the one just opened
+        if packet.source != self.cached_source:
+            self.cached_source = packet.source
+            self.cached_detector.set_video(packet.source)
+        if packet.source != self.pipeline.source:
+            # In flight from the previous video: the frame ring is the new one's
+            return self.frame_detector.detect(packet.frame.copy(), mode, packet.index)
+        # What the cached results depend on besides the frame
+        key = (mode, tuple(sorted(self.detector.tiled_modes)))
+        if not self.annotate_at_display:
+            annotated = self.frame_cache.get_annotated(packet.index, key)
+            if annotated is not None:
+                FRAMES_SKIPPED.inc(reason='frame_cache', source=self.detector.metrics_source)
+                return annotated
+            annotated = self.frame_detector.detect(packet.frame.copy(), mode, packet.index)
+            self.frame_cache.put_annotated(packet.index, key, annotated)
+            return annotated
+        
+        packet.detections = self.frame_cache.get_detections(packet.index, key)
+        if packet.detections is not None:
+            FRAMES_SKIPPED.inc(reason='frame_cache', source=self.detector.metrics_source)
+            return packet.frame
+        
+        # Detections only; render_frame draws them after scaling. The stride
+        # is tuned against the inference cost alone, as drawing happens on
+        # another thread.
+        start = time.perf_counter()
+        packet.detections = self.frame_detector.predict(packet.frame, mode, packet.index)
+        self.frame_detector.stride.record(time.perf_counter() - start,
+                                          self.frame_detector.inferred)
+        self.frame_cache.put_detections(packet.index, key, packet.detections)
+        return packet.frame
+    
+    def render_frame(self, packet):
+        frame = packet.annotated
+        size = fit_size(frame.shape, self.display_size) if self.display_size else None
+        if size:
+            frame = resize_to(frame, size)
+        if packet.detections is not None:
+            if frame is packet.frame:
+                frame = frame.copy()
+            scale = frame.shape[1] / packet.frame.shape[1]
+            detections = {mode: d.scaled(scale) for mode, d in packet.detections.items()}
+            self.detector.annotate(frame, detections)
+            self.detector.add_model_indicator(frame, list(packet.detections))
+        return to_image(frame)
+    
+    def show_frame(self, packet):
+        # Replaces a frame the main loop has not picked up yet
+        self.mailbox.put(packet)
+    
+    def present_frame(self, packet):
+        self.current_frame = packet.frame
+        self.current_frame_pos = packet.index
+        self.current_time = packet.timestamp
+        
+        now = time.perf_counter()
+        # Every frame while stepping through a paused video
+        if not self.video_playing or now - self.last_label_update >= LABEL_INTERVAL:
+            self.last_label_update = now
             self.update_time_display()
             self.update_frame_display()
-            self.progress_bar.set(self.current_time / self.video_duration)
-            
-            self.current_frame = frame.copy()
-            
-            if self.detection_active and self.current_mode:
-                detection_frame = frame.copy()
-                if self.current_mode == 'crowd':
-                    frame = self.detector.crowd_detection(detection_frame)
-                elif self.current_mode == 'fire':
-                    frame = self.detector.fire_detection(detection_frame)
-                elif self.current_mode == 'smoking':
-                    frame = self.detector.smoking_detection(detection_frame)
-                elif self.current_mode == 'vehicle':
-                    frame = self.detector.vehicle_detection(detection_frame)
-                elif self.current_mode == 'weapon':
-                    frame = self.detector.weapon_detection(detection_frame)
-                    
-                self.detector.add_model_indicator(frame, self.current_mode)
-            
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(frame_rgb)
-            img = ImageTk.PhotoImage(image=img)
-            
-            self.video_label.configure(image=img, text="")
-            self.video_label.image = img
-            
-            time.sleep(0.01)
+            if self.video_duration:
+                self.progress_bar.set(self.current_time / self.video_duration)
+        
+        if self.surface.show(packet.image):
+            self.video_label.configure(image=self.surface.photo, text="")
+            self.video_label.image = self.surface.photo
 
     def run(self):
         self.root.mainloop()
+        if self.indexer:
+            self.indexer.cancel()
+        if self.thumbnails:
+            self.thumbnails.cancel()
+        self.pipeline.stop()
+        self.frame_cache.close()
+        self.cached_detector.cache.flush()
+        if self.metrics_server:
+            self.metrics_server.stop()
 
 def main():
     app = HazardDetectionGUI()
@@ -1,15 +1,44 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
-from ultralytics import YOLO
-import cvzone
+import numpy as np
+from annotation import AnnotationRenderer
+from detections import Detections, box_ios, box_iou
+from metrics import INFERENCE_FRAMES, INFERENCE_SECONDS, serve
+from model_manager import ModelManager
+from pipeline import DetectionPipeline
+from preprocess import Preprocessor
+from tiling import tile_grid
+
+# backend: 'torch' runs the .pt weights, 'onnx' / 'openvino' an artifact
+# exported from them on first use (see backends.py)
+MODEL_SPECS = {
+    'crowd': {'path': 'models/crowd-density-model.pt', 'task': 'detect', 'backend': 'torch'},
+    'fire': {'path': 'models/fire-detection-model.pt', 'task': 'segment', 'backend': 'torch'},
+    'smoking': {'path': 'models/smoking-detection-model.pt', 'task': 'detect', 'backend': 'torch'},
+    'vehicle': {'path': 'models/vehicle-detection-model.pt', 'task': 'detect', 'backend': 'torch'},
+    'weapon': {'path': 'models/weapon-detection-model.pt', 'task': 'detect', 'backend': 'torch'},
+}
+MODES = tuple(MODEL_SPECS)
+
+def model_specs(backends=None):
+    # MODEL_SPECS with the backend overridden for every model (a string) or
+    # per model ({mode: backend})
+    if isinstance(backends, str):
+        backends = dict.fromkeys(MODES, backends)
+    backends = backends or {}
+    return {mode: dict(spec, backend=backends.get(mode, spec['backend']))
+            for mode, spec in MODEL_SPECS.items()}
 
 class UnifiedDetectionSystem:
-    def __init__(self):
-        # Initialize all models
-        self.crowd_model = YOLO('models/crowd-density-model.pt', task="detect")
-        self.fire_model = YOLO('models/fire-detection-model.pt', task="segment")
-        self.smoking_model = YOLO('models/smoking-detection-model.pt', task="detect")
-        self.vehicle_model = YOLO('models/vehicle-detection-model.pt', task="detect")
-        self.weapon_model = YOLO('models/weapon-detection-model.pt', task="detect")
+    def __init__(self, max_models=None, max_bytes=None, preload=(), backends=None):
+        # Models are loaded on first use and evicted least-recently-used
+        # once more than max_models (or max_bytes of weights) are resident
+        self.models = ModelManager(model_specs(backends), max_models=max_models,
+                                   max_bytes=max_bytes)
+        for mode in preload:
+            self.models.get(mode)
         
         # Model descriptions for display
         self.model_info = {
@@ -17,7 +46,8 @@ class UnifiedDetectionSystem:
             'fire': {'name': 'Fire Detection', 'color': (0, 69, 255)},   # Orange
             'smoking': {'name': 'Smoking Detection', 'color': (255, 0, 0)},  # Blue
             'vehicle': {'name': 'Vehicle Detection', 'color': (255, 255, 0)},  # Cyan
-            'weapon': {'name': 'Weapon Detection', 'color': (0, 0, 255)}   # Red
+            'weapon': {'name': 'Weapon Detection', 'color': (0, 0, 255)},  # Red
+            'all': {'name': 'All Hazards', 'color': (255, 0, 255)}         # Magenta
         }
         
         # Vehicle detection colors
@@ -37,169 +67,406 @@ class UnifiedDetectionSystem:
         }
         self.DEFAULT_COLOR = (128, 128, 128)
 
+        # Minimum confidence kept by infer() for each mode
+        self.thresholds = {
+            'crowd': 0.3,
+            'fire': 0.2,
+            'smoking': 0.2,
+            'vehicle': 0.6,
+            'weapon': 0.2,
+        }
+        
+        self.drawers = {
+            'crowd': self.draw_crowd,
+            'fire': self.draw_fire,
+            'smoking': self.draw_smoking,
+            'vehicle': self.draw_vehicle,
+            'weapon': self.draw_weapon,
+        }
+        
+        # Caches label patches and per-class colors across frames
+        self.renderer = AnnotationRenderer()
+        
+        # Created on first multi-mode call
+        self.executor = None
+        
+        # Extra keyword arguments passed to every model call (device, imgsz, ...)
+        self.predict_args = {}
+        
+        # 'source' label of the skipped-frame metrics reported by the
+        # wrappers around this detector (DetectionPipeline's default name)
+        self.metrics_source = 'pipeline'
+        
+        # Modes run on overlapping tiles of large frames, so that small,
+        # distant objects (people in a crowd, handguns) keep their
+        # resolution without raising imgsz; see infer_tiled()
+        self.tiled_modes = set()
+        self.tile_size = 640
+        self.tile_overlap = 0.2
+        # Boxes from different tiles are merged when one covers this much of the other
+        self.tile_merge_threshold = 0.7
+        
+        # Frames are letterboxed and normalized once per model input size
+        # and the tensor is shared by every model of that size; turned off
+        # automatically when torch is not available
+        self.preprocessor = Preprocessor()
+        self.shared_preprocessing = True
+
+    @property
+    def crowd_model(self):
+        return self.models.get('crowd')
+
+    @property
+    def fire_model(self):
+        return self.models.get('fire')
+
+    @property
+    def smoking_model(self):
+        return self.models.get('smoking')
+
+    @property
+    def vehicle_model(self):
+        return self.models.get('vehicle')
+
+    @property
+    def weapon_model(self):
+        return self.models.get('weapon')
+
+    def prefetch(self, mode):
+        # Start loading a model in the background, e.g. when a mode is hovered
+        for m in self.resolve_modes(mode):
+            self.models.prefetch(m)
+
+    def resolve_modes(self, mode):
+        # Accepts None, a single mode, 'all' or any collection of modes
+        if not mode:
+            return ()
+        if mode == 'all':
+            return MODES
+        if isinstance(mode, str):
+            return (mode,)
+        return tuple(m for m in MODES if m in mode)
+
+    def detect(self, frame, mode, frame_index=None):
+        # Run the detector(s) for the given mode and stamp the mode indicator
+        frame, _ = self.process(frame, mode, frame_index)
+        return frame
+
     def add_model_indicator(self, frame, current_mode):
-        if current_mode:
-            # Get frame dimensions
-            height, width = frame.shape[:2]
-            
+        modes = self.resolve_modes(current_mode)
+        if modes:
             # Get model info
-            model_info = self.model_info[current_mode]
+            if len(modes) == 1:
+                model_info = self.model_info[modes[0]]
+            elif len(modes) == len(MODES):
+                model_info = self.model_info['all']
+            else:
+                model_info = {
+                    'name': ' + '.join(self.model_info[m]['name'].split()[0] for m in modes),
+                    'color': self.model_info['all']['color'],
+                }
             indicator_text = f"ACTIVATED: {model_info['name']}"
             
-            # Create background rectangle
-            text_size = cv2.getTextSize(indicator_text, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)[0]
-            rect_width = text_size[0] + 20
-            rect_height = text_size[1] + 20
-            
-            # Calculate position (lower right corner)
-            rect_x = width - rect_width - 10
-            rect_y = height - rect_height - 10
-            
-            # Draw semi-transparent background
-            overlay = frame.copy()
-            cv2.rectangle(overlay, 
-                         (rect_x, rect_y),
-                         (width - 10, height - 10),
-                         model_info['color'], 
-                         -1)
-            cv2.addWeighted(overlay, 0.3, frame, 0.7, 0, frame)
-            
-            # Draw border
-            cv2.rectangle(frame, 
-                         (rect_x, rect_y),
-                         (width - 10, height - 10),
-                         model_info['color'], 
-                         2)
-            
-            # Add text
-            text_x = rect_x + 10
-            text_y = height - 20
-            cv2.putText(frame, 
-                       indicator_text,
-                       (text_x, text_y),
-                       cv2.FONT_HERSHEY_SIMPLEX,
-                       0.7,
-                       (255, 255, 255),
-                       2)
+            # Semi-transparent badge in the lower right corner; only the badge
+            # rectangle is blended and its border/text are cached per mode
+            # and frame size
+            self.renderer.badge(frame, indicator_text, model_info['color'])
 
-    def crowd_detection(self, frame):
-        results = self.crowd_model(frame)
-        person_count = 0
+    def infer(self, mode, frame):
+        # Run a single model and return its detections above the mode's threshold
+        if mode in self.tiled_modes:
+            return self.infer_tiled(mode, frame)
+        return self.infer_batch(mode, [frame])[0]
+
+    def infer_batch(self, mode, frames):
+        # One model call for the whole batch; results come back in frame order
+        if mode in self.tiled_modes:
+            # Every frame is already a batch of tiles
+            return [self.infer_tiled(mode, frame) for frame in frames]
+        model = self.models.get(mode)
+        prepared = self.prepare(model, frames)
+        if prepared is None:
+            results = self.call_model(mode, model, list(frames))
+            return [self.postprocess(mode, model, result) for result in results]
         
-        for result in results[0].boxes:
-            x1, y1, x2, y2 = map(int, result.xyxy[0])
-            confidence = float(result.conf[0])
-            
-            if confidence > 0.3:
-                person_count += 1
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (255,0,0), 1)
-                cv2.putText(frame, f'{person_count}', (x1+10, y1+20), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1)
+        letterboxes, tensor = prepared
+        results = self.call_model(mode, model, tensor, len(frames))
+        return [self.postprocess(mode, model, result, letterbox)
+                for result, letterbox in zip(results, letterboxes)]
+
+    def call_model(self, mode, model, source, frames=None):
+        # The model call itself, timed per model for the metrics endpoint
+        start = time.perf_counter()
+        results = model(source, **self.predict_args)
+        INFERENCE_SECONDS.observe(time.perf_counter() - start, model=mode)
+        INFERENCE_FRAMES.inc(len(source) if frames is None else frames, model=mode)
+        return results
+
+    def prepare(self, model, frames):
+        # Shared letterboxed tensor for the model's input size, or None to
+        # let the model preprocess the frames itself
+        if not self.shared_preprocessing:
+            return None
+        size = self.predict_args.get('imgsz') or getattr(model, 'overrides', {}).get('imgsz') or 640
+        if isinstance(size, (list, tuple)):
+            if len(set(size)) != 1:
+                return None
+            size = size[0]
+        try:
+            return self.preprocessor.prepare(frames, size)
+        except ImportError:
+            self.shared_preprocessing = False
+            return None
+
+    def infer_tiled(self, mode, frame):
+        # The tiles and the whole frame go through the model as one batch;
+        # the whole frame still finds large objects cut by tile borders.
+        # Boxes are shifted back to frame coordinates and duplicates from
+        # overlapping tiles are merged by per-class NMS. Boxes from the same
+        # tile are never merged, as the model already ran NMS on them; two
+        # distinct, overlapping objects seen by different tiles can still
+        # be merged when one covers most of the other.
+        height, width = frame.shape[:2]
+        tiles = tile_grid(width, height, self.tile_size, self.tile_overlap)
+        if len(tiles) > 1:
+            tiles.insert(0, (0, 0, width, height))
         
-        total_label = f'People Count: {person_count}'
-        cvzone.putTextRect(frame, total_label, (20, 40),
-                          scale=1, thickness=1,
-                          colorR=(0,0,0), colorB=(0,0,0))
-        return frame
+        model = self.models.get(mode)
+        results = self.call_model(mode, model, [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in tiles], 1)
+        
+        parts, sources = [], []
+        for tile, ((x1, y1, _, _), result) in enumerate(zip(tiles, results)):
+            detections = self.postprocess(mode, model, result)
+            parts.append(detections.with_boxes(detections.xyxy + np.int32([x1, y1, x1, y1])))
+            sources.append(np.full(len(detections), tile))
+        merged = Detections.concatenate(parts, mode, model.names)
+        return merged.nms(self.tile_merge_threshold, box_ios, np.concatenate(sources))
 
-    def fire_detection(self, frame):
-        results = self.fire_model(frame)
+    def tile_settings(self, mode):
+        # Part of what defines a mode's output, e.g. for cache keys
+        if mode in self.tiled_modes:
+            return (self.tile_size, self.tile_overlap, self.tile_merge_threshold)
+        return None
+
+    def postprocess(self, mode, model, result, letterbox=None):
+        detections = Detections.from_result(mode, model.names, result, self.thresholds[mode],
+                                            letterbox.unmap if letterbox else None)
+        if mode == 'smoking':
+            detections = self.suppress_smoking_faces(detections)
+        return detections
+
+    def suppress_smoking_faces(self, detections):
+        # Hide faces (class 1) that overlap a confident smoking box (class 2),
+        # so the smoking label takes precedence. One pairwise IoU matrix
+        # replaces the per face/smoking pair checks.
+        faces = detections.cls == 1
+        smoking = detections[(detections.cls == 2) & (detections.conf > 0.5)]
+        if not faces.any() or not len(smoking):
+            return detections
         
-        for result in results[0].boxes:
-            x1, y1, x2, y2 = map(int, result.xyxy[0])
-            confidence = float(result.conf[0])
-            class_id = int(result.cls[0])
-            class_name = self.fire_model.names[class_id]
-            
-            if confidence > 0.2:
-                cvzone.cornerRect(frame, (x1, y1, x2 - x1, y2 - y1), 
-                                l=5, t=3, rt=1, colorC=(0, 0, 255), 
-                                colorR=(0, 165, 255))
-                
-                label = f'{class_name.upper()} {confidence*100:.1f}%'
-                cvzone.putTextRect(frame, label, (x1, y1 - 10), 0.8, 1, 
-                                 (255, 255, 255), (0, 0, 255), 
-                                 colorB=(0, 255, 0))
+        overlaps = (box_iou(detections.xyxy[faces], smoking.xyxy) > 0.3).any(axis=1)
+        keep = np.ones(len(detections), dtype=bool)
+        keep[np.flatnonzero(faces)[overlaps]] = False
+        return detections[keep]
+
+    def predict(self, frame, modes, frame_index=None):
+        # Returns {mode: Detections}; several modes run in parallel threads
+        # (the models release the GIL during inference). frame_index is
+        # unused here but lets wrappers such as StridedDetector be stacked.
+        try:
+            return self.map_modes(self.infer, self.resolve_modes(modes), frame)
+        finally:
+            self.preprocessor.release()
+
+    def map_modes(self, fn, modes, *args):
+        # Call fn(mode, *args) for every mode, concurrently when there are several
+        if len(modes) <= 1:
+            return {mode: fn(mode, *args) for mode in modes}
+        
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=len(MODES),
+                                               thread_name_prefix='detector')
+        futures = {mode: self.executor.submit(fn, mode, *args) for mode in modes}
+        return {mode: future.result() for mode, future in futures.items()}
+
+    def annotate(self, frame, detections):
+        # Draw every mode's detections onto one frame, in a fixed order
+        for mode in MODES:
+            if mode in detections:
+                self.drawers[mode](frame, detections[mode])
         return frame
 
+    def process(self, frame, modes, frame_index=None):
+        # Predict and draw; returns the annotated frame and {mode: Detections}
+        detections = self.predict(frame, modes, frame_index)
+        frame = self.annotate(frame, detections)
+        self.add_model_indicator(frame, modes)
+        return frame, detections
+
+    def detect_multi(self, frame, modes, frame_index=None):
+        # Returns the annotated frame and one merged detection list
+        frame, detections = self.process(frame, modes, frame_index)
+        return frame, merge_records(detections)
+
+    def predict_batch(self, frames, modes, frame_indices=None):
+        # Batched counterpart of predict(): one model call per mode for all
+        # frames. Returns [{mode: Detections}, ...] in input order.
+        modes = self.resolve_modes(modes)
+        try:
+            batch = self.map_modes(self.infer_batch, modes, frames)
+        finally:
+            self.preprocessor.release()
+        return [{mode: batch[mode][i] for mode in modes} for i in range(len(frames))]
+
+    def detect_batch(self, frames, modes, frame_indices=None):
+        # Batched counterpart of detect_multi() for offline processing.
+        # Returns [(annotated frame, detections), ...] in input order.
+        modes = self.resolve_modes(modes)
+        if not modes:
+            return [(frame, []) for frame in frames]
+        
+        batch = self.predict_batch(frames, modes, frame_indices)
+        
+        outputs = []
+        for frame, detections in zip(frames, batch):
+            frame = self.annotate(frame, detections)
+            self.add_model_indicator(frame, modes)
+            outputs.append((frame, merge_records(detections)))
+        return outputs
+
+    def crowd_detection(self, frame):
+        return self.draw_crowd(frame, self.infer('crowd', frame))
+
+    def fire_detection(self, frame):
+        return self.draw_fire(frame, self.infer('fire', frame))
+
     def smoking_detection(self, frame):
-        results = self.smoking_model(frame)
+        return self.draw_smoking(frame, self.infer('smoking', frame))
+
+    def vehicle_detection(self, frame):
+        return self.draw_vehicle(frame, self.infer('vehicle', frame))
+
+    def weapon_detection(self, frame):
+        return self.draw_weapon(frame, self.infer('weapon', frame))
+
+    def draw_crowd(self, frame, detections):
+        r = self.renderer
+        r.boxes(frame, detections.xyxy, (255,0,0), 1)
+        for person_count, (x1, y1, _, _) in enumerate(detections.xyxy.tolist(), 1):
+            r.text(frame, f'{person_count}', (x1+10, y1+20), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1)
         
-        face_boxes = []
-        smoking_boxes = []
-
-        for result in results[0].boxes:
-            x1, y1, x2, y2 = map(int, result.xyxy[0])
-            confidence = float(result.conf[0])
-            class_id = int(result.cls[0])
-
-            if confidence > 0.5:
-                if class_id == 1:
-                    face_boxes.append((x1, y1, x2, y2))
-                elif class_id == 2:
-                    smoking_boxes.append((x1, y1, x2, y2))
-
-        for result in results[0].boxes:
-            x1, y1, x2, y2 = map(int, result.xyxy[0])
-            confidence = float(result.conf[0])
-            class_id = int(result.cls[0])
-            class_name = self.smoking_model.names[class_id]
-
-            if confidence > 0.2:
-                if class_id == 0:
-                    label = f'{class_name} {confidence*100:.2f}%'
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 165, 255), 1)
-                    cvzone.putTextRect(frame, label, (x1, y1 - 10), 0.6, 1, 
-                                     (255, 255, 255), (0, 165, 255), 
-                                     colorB=(0, 255, 0))
-                
-                elif class_id == 2:
-                    label = f'{class_name} {confidence*100:.2f}%'
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                    cvzone.putTextRect(frame, label, (x1, y1 - 10), 1, 1, 
-                                     (255, 255, 255), (0, 0, 255), 
-                                     colorB=(0, 255, 0))
+        total_label = f'People Count: {len(detections)}'
+        r.label(frame, total_label, (20, 40),
+                scale=1, thickness=1,
+                colorR=(0,0,0), colorB=(0,0,0))
         return frame
 
-    def vehicle_detection(self, frame):
-        results = self.vehicle_model(frame)
+    def draw_fire(self, frame, detections):
+        r = self.renderer
+        r.corners(frame, detections.xyxy, length=5, thickness=3, color=(0, 0, 255),
+                  rect_thickness=1, rect_color=(0, 165, 255))
+        for (x1, y1, _, _), confidence, class_name in zip(detections.xyxy.tolist(),
+                                                          detections.conf.tolist(),
+                                                          detections.class_names()):
+            label = f'{class_name.upper()} {confidence*100:.1f}%'
+            r.label(frame, label, (x1, y1 - 10), 0.8, 1, 
+                    (255, 255, 255), (0, 0, 255), 
+                    colorB=(0, 255, 0))
+        return frame
+
+    def draw_smoking(self, frame, detections):
+        # Class 0: cigarette, class 1: face, class 2: smoking
+        r = self.renderer
+        cigarettes = detections.of_class(0)
+        r.boxes(frame, cigarettes.xyxy, (0, 165, 255), 1)
+        for (x1, y1, _, _), confidence, class_name in zip(cigarettes.xyxy.tolist(),
+                                                          cigarettes.conf.tolist(),
+                                                          cigarettes.class_names()):
+            label = f'{class_name} {confidence*100:.2f}%'
+            r.label(frame, label, (x1, y1 - 10), 0.6, 1, 
+                    (255, 255, 255), (0, 165, 255), 
+                    colorB=(0, 255, 0))
         
-        for result in results[0].boxes:
-            x1, y1, x2, y2 = map(int, result.xyxy[0])
-            confidence = float(result.conf[0])
-            class_id = int(result.cls[0])
-            class_name = self.vehicle_model.names[class_id]
-            
-            if confidence > 0.6:
-                color = self.vehicle_colors.get(class_name.lower(), self.DEFAULT_COLOR)
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                
-                label = f'{class_name} {confidence*100:.2f}%'
-                text_y = max(y1 - 10, 20)
-                
-                cvzone.putTextRect(frame, label, (x1, text_y), 
-                                 scale=0.8, thickness=1,
-                                 colorR=color, colorT=(255, 255, 255),
-                                 offset=5, border=2)
+        # Faces left after suppress_smoking_faces()
+        faces = detections.of_class(1)
+        r.boxes(frame, faces.xyxy, (0, 0, 0), 1)
+        for (x1, y1, _, _), confidence, class_name in zip(faces.xyxy.tolist(),
+                                                          faces.conf.tolist(),
+                                                          faces.class_names()):
+            label = f'{class_name} {confidence*100:.2f}%'
+            r.text(frame, label, (x1, y1 - 10), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+        
+        smoking = detections.of_class(2)
+        r.boxes(frame, smoking.xyxy, (0, 0, 255), 2)
+        for (x1, y1, _, _), confidence, class_name in zip(smoking.xyxy.tolist(),
+                                                          smoking.conf.tolist(),
+                                                          smoking.class_names()):
+            label = f'{class_name} {confidence*100:.2f}%'
+            r.label(frame, label, (x1, y1 - 10), 1, 1, 
+                    (255, 255, 255), (0, 0, 255), 
+                    colorB=(0, 255, 0))
         return frame
 
-    def weapon_detection(self, frame):
-        results = self.weapon_model(frame)
+    def draw_vehicle(self, frame, detections):
+        r = self.renderer
+        colors = r.class_colors(detections.names, self.vehicle_colors, self.DEFAULT_COLOR)
+        
+        # One batched box call per vehicle class
+        for class_id in np.unique(detections.cls).tolist():
+            r.boxes(frame, detections.xyxy[detections.cls == class_id], colors[class_id], 2)
         
-        for result in results[0].boxes:
-            x1, y1, x2, y2 = map(int, result.xyxy[0])
-            confidence = float(result.conf[0])
-            class_name = " GUN "
+        for (x1, y1, _, _), confidence, class_id in zip(detections.xyxy.tolist(),
+                                                        detections.conf.tolist(),
+                                                        detections.cls.tolist()):
+            label = f'{detections.names[class_id]} {confidence*100:.2f}%'
+            text_y = max(y1 - 10, 20)
             
-            if confidence > 0.2:
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 1)
-                
-                label = f'{class_name} {confidence*100:.2f}%'
-                cvzone.putTextRect(frame, label, (x1, y1 - 10), 1, 1, 
-                                 (255, 255, 255), (0, 0, 255), 
-                                 colorB=(0, 255, 0))
+            r.label(frame, label, (x1, text_y), 
+                    scale=0.8, thickness=1,
+                    colorR=colors[class_id], colorT=(255, 255, 255),
+                    offset=5, border=2)
         return frame
 
+    def draw_weapon(self, frame, detections):
+        r = self.renderer
+        class_name = " GUN "
+        r.boxes(frame, detections.xyxy, (0, 0, 255), 1)
+        for (x1, y1, _, _), confidence in zip(detections.xyxy.tolist(),
+                                              detections.conf.tolist()):
+            label = f'{class_name} {confidence*100:.2f}%'
+            r.label(frame, label, (x1, y1 - 10), 1, 1, 
+                    (255, 255, 255), (0, 0, 255), 
+                    colorB=(0, 255, 0))
+        return frame
+
+def merge_records(detections):
+    # {mode: Detections} -> one list of per-detection dicts in mode order
+    return [record for mode in MODES if mode in detections
+            for record in detections[mode].to_records()]
+
+class DetectorWrapper:
+    # Base for layers that change how detections are produced (stride,
+    # gating, caching) while reusing the wrapped detector for drawing.
+    # Wrappers can be stacked; anything not overridden is delegated.
+    def __init__(self, detector):
+        self.detector = detector
+
+    def __getattr__(self, name):
+        return getattr(self.detector, name)
+
+    def predict(self, frame, modes, frame_index=None):
+        return self.detector.predict(frame, modes, frame_index)
+
+    def predict_batch(self, frames, modes, frame_indices=None):
+        return self.detector.predict_batch(frames, modes, frame_indices)
+
+    process = UnifiedDetectionSystem.process
+    detect = UnifiedDetectionSystem.detect
+    detect_multi = UnifiedDetectionSystem.detect_multi
+    detect_batch = UnifiedDetectionSystem.detect_batch
+
 def main():
     # Initialize the detection system
     detector = UnifiedDetectionSystem()
@@ -209,7 +476,8 @@ def main():
     # Open video capture
     cap = cv2.VideoCapture(video_path)  # Use 0 for webcam or provide video path
     
-    current_mode = None
+    # Read by the inference stage, written by the key handling below
+    state = {'mode': None}
     
     # Display instructions at startup
     print("\nUnified Detection System")
@@ -220,53 +488,66 @@ def main():
     print("3: Smoking Detection")
     print("4: Vehicle Detection")
     print("5: Weapon Detection")
+    print("6: All Hazards")
+    print("+/-: Motion gate sensitivity")
     print("Q: Quit")
     print("------------------------\n")
     
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
+    # Infer every Nth frame and track in between, with N tuned to keep up
+    # with the source frame rate; frames of a static scene reuse the last
+    # detections instead of running the models
+    from gating import GatedDetector
+    from tracking import StridedDetector
+    gated = GatedDetector(detector)
+    strided = StridedDetector(gated, target_fps=cap.get(cv2.CAP_PROP_FPS))
+    
+    # Decoding and inference run in background threads; the main thread
+    # only displays the latest annotated frame and handles key presses
+    pipeline = DetectionPipeline(
+        cap,
+        process=lambda packet: strided.detect(packet.frame.copy(), state['mode'], packet.index)
+    )
+    pipeline.start()
+    metrics_server = serve()
+    
+    keys = {
+        ord('1'): 'crowd',
+        ord('2'): 'fire',
+        ord('3'): 'smoking',
+        ord('4'): 'vehicle',
+        ord('5'): 'weapon',
+        ord('6'): 'all',
+    }
+    
+    while True:
+        packet = pipeline.read(timeout=0.05)
+        if packet is None and not pipeline.running:
             break
         
-        # Create a copy of the frame for detection
-        detection_frame = frame.copy()
-        
         # Check for key press
         key = cv2.waitKey(1) & 0xFF
         
-        if key == ord('1'):
-            current_mode = 'crowd'
-        elif key == ord('2'):
-            current_mode = 'fire'
-        elif key == ord('3'):
-            current_mode = 'smoking'
-        elif key == ord('4'):
-            current_mode = 'vehicle'
-        elif key == ord('5'):
-            current_mode = 'weapon'
+        if key in keys:
+            state['mode'] = keys[key]
+        elif key in (ord('+'), ord('-')):
+            step = 0.1 if key == ord('+') else -0.1
+            gated.gate.sensitivity = round(min(max(gated.gate.sensitivity + step, 0.0), 1.0), 1)
+            print(f"Motion gate sensitivity: {gated.gate.sensitivity}")
         elif key == ord('q'):
             break
         
-        # Apply detection based on current mode
-        if current_mode == 'crowd':
-            frame = detector.crowd_detection(detection_frame)
-        elif current_mode == 'fire':
-            frame = detector.fire_detection(detection_frame)
-        elif current_mode == 'smoking':
-            frame = detector.smoking_detection(detection_frame)
-        elif current_mode == 'vehicle':
-            frame = detector.vehicle_detection(detection_frame)
-        elif current_mode == 'weapon':
-            frame = detector.weapon_detection(detection_frame)
-        
-        # Add model indicator to frame
-        detector.add_model_indicator(frame, current_mode)
-            
         # Display the frame
-        cv2.imshow('Multi Hazard Detection System', frame)
+        if packet is not None:
+            cv2.imshow('Multi Hazard Detection System', packet.annotated)
     
+    pipeline.stop()
+    if metrics_server:
+        metrics_server.stop()
     cap.release()
     cv2.destroyAllWindows()
+    
+    stats = gated.gate.stats()
+    print(f"Motion gate skipped {stats['skip_ratio']:.0%} of {stats['checked']} checked frames")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,153 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from backends import INT8, ONNX, artifact_path, export_model
+from detections import box_iou
+from preprocess import Letterbox, PAD_VALUE
+from prototype1 import MODEL_SPECS, UnifiedDetectionSystem
+from tracking import greedy_match
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp'}
+
+
+def load_frames(folder, limit=None):
+    paths = sorted(p for p in Path(folder).rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS)
+    frames = []
+    for path in paths[:limit]:
+        frame = cv2.imread(str(path))
+        if frame is not None:
+            frames.append(frame)
+    if not frames:
+        raise IOError(f"No images found in {folder}")
+    return frames
+
+
+def letterbox_tensor(frame, size):
+    # Square letterboxed NCHW float32 input, as the exporter traced the model
+    box = Letterbox.fit(frame.shape, size, auto=False)
+    left, top, _, _ = box.pad
+    new_w, new_h = box.resized
+    canvas = np.full((size, size, 3), PAD_VALUE, np.uint8)
+    canvas[top:top + new_h, left:left + new_w] = cv2.resize(frame, (new_w, new_h))
+    return np.ascontiguousarray(canvas.transpose(2, 0, 1)[None, ::-1], np.float32) / 255
+
+
+class FrameReader:
+    # onnxruntime CalibrationDataReader over the calibration frames
+    def __init__(self, input_name, frames, size):
+        self.input_name = input_name
+        self.frames = iter(frames)
+        self.size = size
+
+    def get_next(self):
+        frame = next(self.frames, None)
+        if frame is None:
+            return None
+        return {self.input_name: letterbox_tensor(frame, self.size)}
+
+
+def quantize_model(spec, frames, size=640):
+    # FP32 ONNX export -> static INT8 (QDQ) model calibrated on frames.
+    # Only Conv/MatMul weights and activations are quantized; the detection
+    # head's decode (concat, sigmoid, DFL) stays FP32, which keeps box
+    # coordinates and confidences close to the original.
+    import onnx
+    from onnxruntime.quantization import (CalibrationMethod, QuantFormat, QuantType,
+                                          quantize_static)
+
+    fp32 = export_model(spec, ONNX, size)
+    int8 = artifact_path(spec['path'], INT8)
+    input_name = onnx.load(str(fp32), load_external_data=False).graph.input[0].name
+
+    quantize_static(str(fp32), str(int8), FrameReader(input_name, frames, size),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    op_types_to_quantize=['Conv', 'MatMul'],
+                    calibrate_method=CalibrationMethod.MinMax)
+
+    # Ultralytics reads class names, stride and imgsz from the metadata
+    source, model = onnx.load(str(fp32)), onnx.load(str(int8))
+    del model.metadata_props[:]
+    model.metadata_props.extend(source.metadata_props)
+    onnx.save(model, str(int8))
+    return int8
+
+
+def compare_detections(reference, candidate, iou_threshold=0.5):
+    # Matches INT8 boxes to FP32 boxes of the same class on one frame;
+    # returns (matched, reference count, candidate count, IoU sum, |conf| diff sum)
+    if not len(reference) or not len(candidate):
+        return 0, len(reference), len(candidate), 0.0, 0.0
+    ious = box_iou(reference.xyxy, candidate.xyxy)
+    ious[reference.cls[:, None] != candidate.cls[None, :]] = 0
+    pairs = list(greedy_match(ious, iou_threshold))
+    iou_sum = sum(float(ious[i, j]) for i, j in pairs)
+    conf_sum = sum(abs(float(reference.conf[i] - candidate.conf[j])) for i, j in pairs)
+    return len(pairs), len(reference), len(candidate), iou_sum, conf_sum
+
+
+def evaluate(mode, frames, predict_args=None):
+    # Runs the FP32 ONNX and the INT8 model of one mode on the same frames
+    timings, outputs = {}, {}
+    for backend in (ONNX, INT8):
+        detector = UnifiedDetectionSystem(backends={mode: backend})
+        detector.predict_args = dict(predict_args or {})
+        detector.infer(mode, frames[0])
+        start = time.perf_counter()
+        outputs[backend] = [detector.infer(mode, frame) for frame in frames]
+        timings[backend] = (time.perf_counter() - start) / len(frames)
+
+    totals = np.zeros(5)
+    for reference, candidate in zip(outputs[ONNX], outputs[INT8]):
+        totals += compare_detections(reference, candidate)
+    matched, n_ref, n_int8, iou_sum, conf_sum = totals
+    return {
+        'mode': mode,
+        'frames': len(frames),
+        'fp32_ms': timings[ONNX] * 1000,
+        'int8_ms': timings[INT8] * 1000,
+        'speedup': timings[ONNX] / timings[INT8],
+        # Share of FP32 detections the INT8 model reproduces, and vice versa
+        'recall': matched / n_ref if n_ref else 1.0,
+        'precision': matched / n_int8 if n_int8 else 1.0,
+        'mean_iou': iou_sum / matched if matched else None,
+        'mean_conf_delta': conf_sum / matched if matched else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8 post-training quantization of the hazard models")
+    parser.add_argument('calibration', help="Folder of representative frames (images)")
+    parser.add_argument('-m', '--modes', nargs='+', default=list(MODEL_SPECS),
+                        choices=list(MODEL_SPECS))
+    parser.add_argument('--frames', type=int, default=200,
+                        help="Maximum number of calibration frames")
+    parser.add_argument('--eval', metavar='FOLDER',
+                        help="Frames for the accuracy/speed comparison (default: calibration frames)")
+    parser.add_argument('--imgsz', type=int, default=640)
+    args = parser.parse_args()
+
+    frames = load_frames(args.calibration, args.frames)
+    eval_frames = load_frames(args.eval) if args.eval else frames
+    predict_args = {'device': 'cpu', 'verbose': False}
+
+    print(f"{'mode':>8} {'fp32 ms':>8} {'int8 ms':>8} {'speedup':>8} {'recall':>7} "
+          f"{'precision':>9} {'IoU':>6}")
+    for mode in args.modes:
+        spec = MODEL_SPECS[mode]
+        int8 = quantize_model(spec, frames, args.imgsz)
+        report = evaluate(mode, eval_frames, predict_args)
+        with open(int8.with_suffix('.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+        iou = f"{report['mean_iou']:.3f}" if report['mean_iou'] is not None else '-'
+        print(f"{mode:>8} {report['fp32_ms']:>8.1f} {report['int8_ms']:>8.1f} "
+              f"{report['speedup']:>7.2f}x {report['recall']:>7.1%} "
+              f"{report['precision']:>9.1%} {iou:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import bisect
+import json
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+from keyframes import file_signature
+
+
+def strip_paths(video_path):
+    # The thumbnails side by side in one JPEG, and what they show
+    return f"{video_path}.thumbs.jpg", f"{video_path}.thumbs.json"
+
+
+class ThumbnailStrip:
+    # Small BGR images of frames sampled across a video, in frame order
+    def __init__(self, video_path, width=160):
+        self.video_path = video_path
+        self.width = width
+        self.frames = []
+        self.images = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self.frames)
+
+    def add(self, frame_index, image):
+        with self._lock:
+            i = bisect.bisect_left(self.frames, frame_index)
+            self.frames.insert(i, frame_index)
+            self.images.insert(i, image)
+
+    def nearest(self, frame_index):
+        # Thumbnail of the last sampled frame at or before frame_index
+        with self._lock:
+            if not self.frames:
+                return None
+            i = bisect.bisect_right(self.frames, frame_index) - 1
+            return self.images[max(i, 0)]
+
+    def save(self, settings):
+        image_path, meta_path = strip_paths(self.video_path)
+        with self._lock:
+            if not self.images:
+                return
+            strip = np.hstack(self.images)
+            meta = {'signature': file_signature(self.video_path), 'settings': settings,
+                    'frames': self.frames, 'width': self.width}
+        try:
+            partial = image_path + '.partial.jpg'
+            if not cv2.imwrite(partial, strip, [cv2.IMWRITE_JPEG_QUALITY, 85]):
+                raise OSError(f"cannot write {partial}")
+            os.replace(partial, image_path)
+            with open(meta_path + '.partial', 'w') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + '.partial', meta_path)
+        except OSError as e:
+            print(f"Could not save thumbnails for {self.video_path}: {e}")
+
+    @classmethod
+    def load(cls, video_path, settings):
+        # None unless a strip made with the same settings from the
+        # unchanged video is on disk
+        image_path, meta_path = strip_paths(video_path)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['signature'] != file_signature(video_path) or meta['settings'] != settings:
+                return None
+            strip_image = cv2.imread(image_path)
+            width = meta['width']
+            if strip_image is None or strip_image.shape[1] != width * len(meta['frames']):
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        strip = cls(video_path, width)
+        for i, frame_index in enumerate(meta['frames']):
+            strip.add(frame_index, strip_image[:, i * width:(i + 1) * width].copy())
+        return strip
+
+
+def lower_priority():
+    # Lowers the calling thread's scheduling priority where the OS allows it
+    # per thread (Linux); elsewhere the job's pauses between frames remain
+    if sys.platform.startswith('linux') and hasattr(os, 'setpriority'):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except OSError:
+            pass
+
+
+class ThumbnailJob:
+    # Fills a ThumbnailStrip in a background thread: one sample every
+    # interval seconds (at most max_thumbs), each taken from the keyframe
+    # preceding the sample so that only keyframes are decoded. The
+    # keyframe index is handed over with use_keyframes() once available
+    # (None when the video cannot be indexed: the samples are then decoded
+    # at their exact positions). A finished strip is saved next to the video
+    # and loaded from there the next time.
+    def __init__(self, video_path, interval=10.0, width=160, max_thumbs=200, pause=0.005):
+        self.video_path = video_path
+        self.interval = interval
+        self.max_thumbs = max_thumbs
+        self.pause = pause
+        self.strip = ThumbnailStrip(video_path, width)
+        self.keyframes = None
+        self._ready = threading.Event()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='thumbnails')
+
+    @property
+    def settings(self):
+        return {'interval': self.interval, 'width': self.strip.width,
+                'max_thumbs': self.max_thumbs}
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+        self._ready.set()
+
+    def use_keyframes(self, index):
+        self.keyframes = index
+        self._ready.set()
+
+    def _run(self):
+        lower_priority()
+        saved = ThumbnailStrip.load(self.video_path, self.settings)
+        if saved is not None:
+            self.strip = saved
+            return
+
+        self._ready.wait()
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            if self._generate(cap):
+                self.strip.save(self.settings)
+        finally:
+            cap.release()
+
+    def targets(self, fps, frame_count):
+        duration = frame_count / fps
+        interval = max(self.interval, duration / self.max_thumbs)
+        samples = [int(k * interval * fps) for k in range(int(duration / interval) + 1)]
+        samples = [s for s in samples if s < frame_count]
+        index = self.keyframes
+        if index is None or index.video_path != self.video_path:
+            return samples
+        return sorted({index.preceding(s) for s in samples})
+
+    def _generate(self, cap):
+        # Returns True when every sample was taken
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if not fps or frame_count <= 0:
+            return False
+        for target in self.targets(fps, frame_count):
+            if self._cancel.is_set():
+                return False
+            cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            ret, frame = cap.read()
+            if not ret:
+                continue
+            height = max(1, round(frame.shape[0] * self.strip.width / frame.shape[1]))
+            self.strip.add(target, cv2.resize(frame, (self.strip.width, height),
+                                              interpolation=cv2.INTER_AREA))
+            # Leaves the CPU (and the disk) to playback between samples
+            self._cancel.wait(self.pause)
+        return True
@@ -0,0 +1,25 @@
+import math
+
+import numpy as np
+
+
+def tile_starts(length, tile, overlap):
+    # Evenly spread tile offsets along one axis with at least `overlap`
+    # pixels shared by neighbouring tiles
+    if length <= tile:
+        return [0]
+    count = math.ceil((length - overlap) / (tile - overlap))
+    return np.linspace(0, length - tile, count).round().astype(int).tolist()
+
+
+def tile_grid(width, height, tile_size=640, overlap=0.2, min_scale=1.5):
+    # (x1, y1, x2, y2) tiles covering the frame. Frames less than
+    # min_scale times the tile size in both directions are not worth
+    # tiling and give a single full-frame tile.
+    if width < tile_size * min_scale and height < tile_size * min_scale:
+        return [(0, 0, width, height)]
+    pixels = int(tile_size * overlap)
+    tile_w, tile_h = min(tile_size, width), min(tile_size, height)
+    return [(x, y, x + tile_w, y + tile_h)
+            for y in tile_starts(height, tile_h, pixels)
+            for x in tile_starts(width, tile_w, pixels)]
@@ -0,0 +1,145 @@
+import math
+import time
+
+import numpy as np
+from detections import box_iou
+from metrics import FRAMES_SKIPPED
+from prototype1 import DetectorWrapper
+
+
+def greedy_match(ious, threshold):
+    # Highest-IoU-first one-to-one matching; yields (row, col) pairs
+    rows, cols = np.nonzero(ious >= threshold)
+    used_rows, used_cols = set(), set()
+    for k in np.argsort(-ious[rows, cols], kind='stable'):
+        row, col = int(rows[k]), int(cols[k])
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        yield row, col
+
+
+class IoUTracker:
+    # Associates consecutive inferences by IoU and keeps a constant-velocity
+    # estimate per box, so the last detections can be carried forward to
+    # the frames between inferences
+    def __init__(self, iou_threshold=0.3, smoothing=0.5):
+        self.iou_threshold = iou_threshold
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        self.detections = None
+        self.boxes = np.zeros((0, 4), np.float32)
+        self.velocity = np.zeros((0, 4), np.float32)
+        self.frame_index = None
+
+    def update(self, detections, frame_index):
+        boxes = detections.xyxy.astype(np.float32)
+        velocity = np.zeros_like(boxes)
+
+        if self.detections is not None and len(self.detections) and len(detections):
+            frames = max(frame_index - self.frame_index, 1)
+            ious = box_iou(self.boxes, boxes)
+            # Only associate boxes of the same class
+            ious[self.detections.cls[:, None] != detections.cls[None, :]] = 0
+            for old, new in greedy_match(ious, self.iou_threshold):
+                measured = (boxes[new] - self.boxes[old]) / frames
+                velocity[new] = (self.smoothing * measured
+                                 + (1 - self.smoothing) * self.velocity[old])
+
+        self.detections = detections
+        self.boxes = boxes
+        self.velocity = velocity
+        self.frame_index = frame_index
+
+    def predict(self, frame_index):
+        boxes = self.boxes + self.velocity * (frame_index - self.frame_index)
+        return self.detections.with_boxes(np.rint(boxes).astype(np.int32))
+
+
+class AdaptiveStride:
+    # Picks how many frames pass between inferences so that the average
+    # per-frame cost stays within 1 / target_fps
+    def __init__(self, target_fps=None, stride=1, max_stride=8, smoothing=0.2):
+        self.target_fps = target_fps
+        self.stride = stride
+        self.max_stride = max_stride
+        self.smoothing = smoothing
+        self.infer_time = None
+        self.track_time = None
+
+    def record(self, seconds, inferred):
+        if inferred:
+            self.infer_time = self._average(self.infer_time, seconds)
+        else:
+            self.track_time = self._average(self.track_time, seconds)
+        self._adjust()
+
+    def _average(self, current, sample):
+        if current is None:
+            return sample
+        return (1 - self.smoothing) * current + self.smoothing * sample
+
+    def _adjust(self):
+        if not self.target_fps or self.infer_time is None:
+            return
+        budget = 1.0 / self.target_fps
+        track_time = self.track_time or 0.0
+        if self.infer_time <= budget:
+            stride = 1
+        elif track_time >= budget:
+            stride = self.max_stride
+        else:
+            # Smallest N with (infer + (N - 1) * track) / N <= budget
+            stride = math.ceil((self.infer_time - track_time) / (budget - track_time))
+        self.stride = max(1, min(stride, self.max_stride))
+
+
+class StridedDetector(DetectorWrapper):
+    # Runs the models on every Nth frame only and propagates the last
+    # detections with an IoU tracker on the frames in between
+    def __init__(self, detector, target_fps=None, stride=1, max_stride=8):
+        super().__init__(detector)
+        self.stride = AdaptiveStride(target_fps, stride, max_stride)
+        self.trackers = {}
+        self.modes = ()
+        self.last_inferred = None
+        self.inferred = False
+        self.calls = 0
+
+    def predict(self, frame, modes, frame_index=None):
+        modes = self.resolve_modes(modes)
+        if frame_index is None:
+            frame_index = self.calls
+        self.calls += 1
+
+        elapsed = None if self.last_inferred is None else frame_index - self.last_inferred
+        # Re-infer on mode changes and seeks, and whenever the stride is due
+        inferred = (modes != self.modes or elapsed is None
+                    or elapsed < 0 or elapsed >= self.stride.stride)
+
+        if inferred:
+            detections = self.detector.predict(frame, modes, frame_index)
+            if modes != self.modes:
+                self.trackers = {mode: IoUTracker() for mode in modes}
+                self.modes = modes
+            for mode in modes:
+                self.trackers[mode].update(detections[mode], frame_index)
+            self.last_inferred = frame_index
+        else:
+            detections = {mode: self.trackers[mode].predict(frame_index) for mode in modes}
+            FRAMES_SKIPPED.inc(reason='stride', source=self.metrics_source)
+
+        self.inferred = inferred
+        return detections
+
+    def process(self, frame, modes, frame_index=None):
+        # Timed here rather than in predict() so that drawing is included
+        # in the per-frame cost the stride is tuned against
+        start = time.perf_counter()
+        result = super().process(frame, modes, frame_index)
+        if self.modes:
+            self.stride.record(time.perf_counter() - start, self.inferred)
+        return result